@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''
+Compares the per-frame CPU time of drawing a context through PyOpenGL with
+that of drawing it through the raw gldispatch entry points.  Runs headless
+through EGL; from the top of the tree:
+
+    EGL_PLATFORM=surfaceless python3 -m benchmarks.dispatch
+'''
+import argparse
+import os
+import time
+
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import numpy as np                  # noqa: E402
+from OpenGL import GL               # noqa: E402
+
+import glotlib                      # noqa: E402
+import glotlib.egl                  # noqa: E402
+
+
+def make_context(args):
+    ctx = glotlib.Context(args.width, args.height, msaa=1)
+    X   = np.linspace(0, 1, args.npoints)
+    for i in range(args.nplots):
+        p = ctx.add_plot((args.nplots, 1, i + 1), limits=(0, -1, 1, 1))
+        for j in range(args.nseries):
+            p.add_lines(X=X, Y=np.sin(2 * np.pi * (X + j / args.nseries)),
+                        width=1)
+    return ctx
+
+
+def time_frames(ctx, nframes):
+    '''
+    Returns the median CPU time, in seconds, spent in Context._draw() for a
+    full redraw of ctx.  The GPU is drained after each frame, outside of the
+    timed section.
+    '''
+    dts = []
+    for i in range(nframes):
+        ctx.mark_dirty()
+        t0 = time.perf_counter()
+        ctx._draw(i)
+        dts.append(time.perf_counter() - t0)
+        GL.glFinish()
+    return float(np.median(dts))
+
+
+def main(args):
+    egl = glotlib.egl.EGLContext(args.width, args.height)
+    GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+    results = {}
+    for raw in (False, True):
+        glotlib.init(raw_dispatch=raw)
+        glotlib.programs.load()
+        ctx = make_context(args)
+        time_frames(ctx, args.warmup)
+        results[raw] = time_frames(ctx, args.frames)
+        glotlib.main.CONTEXTS.discard(ctx)
+
+    print('%u plots x %u series of %u points, median of %u frames:' %
+          (args.nplots, args.nseries, args.npoints, args.frames))
+    print('    PyOpenGL: %8.3f ms/frame' % (results[False] * 1e3))
+    print('    raw:      %8.3f ms/frame (%.2fx)' %
+          (results[True] * 1e3, results[False] / results[True]))
+
+    egl.destroy()
+
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--nplots', type=int, default=4)
+    parser.add_argument('--nseries', type=int, default=16)
+    parser.add_argument('--npoints', type=int, default=1000)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    main(parser.parse_args())
+
+
+if __name__ == '__main__':
+    _main()
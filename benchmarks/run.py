@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+'''
+Benchmarks the data and draw paths of glotlib on a headless GL context, by
+default Mesa's llvmpipe software rasterizer through EGL.  From the top of the
+tree:
+
+    python3 -m benchmarks.run --output results.json
+    python3 -m benchmarks.run --output new.json --baseline results.json
+    python3 -m benchmarks.run --results new.json --baseline results.json
+
+Each benchmark is run on series of each of the requested sizes and the
+results, in seconds per operation, are written as JSON.  With --baseline, the
+results are compared against a previous run and any benchmark that got slower
+by more than the threshold is flagged; the exit status is then 1.
+'''
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+
+import numpy as np                  # noqa: E402
+from OpenGL import GL               # noqa: E402
+
+import glotlib                      # noqa: E402
+import glotlib.egl                  # noqa: E402
+
+
+SIZES        = [10**k for k in range(3, 9)]
+APPEND_LEN   = 1000
+APPEND_COUNT = 100
+PAN_STEPS    = 50
+WIDTH        = 1024
+HEIGHT       = 768
+
+
+def _reps(n):
+    '''
+    Returns the number of repetitions used to time an O(n) operation.
+    '''
+    return max(1, min(20, 10**6 // n))
+
+
+def _time(f, reps):
+    '''
+    Returns the fastest of reps timed calls to f(i), in seconds, each one
+    including the time for the GPU to finish.
+    '''
+    best = math.inf
+    for i in range(reps):
+        GL.glFinish()
+        t0 = time.perf_counter()
+        f(i)
+        GL.glFinish()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _data(n, phase=0):
+    X = np.arange(n, dtype=np.float64)
+    Y = np.sin(X * (2 * np.pi / 1000) + phase)
+    return X, Y
+
+
+def bench_size(n):
+    ctx  = glotlib.Context(WIDTH, HEIGHT, msaa=1)
+    p    = ctx.add_plot(111)
+    X, Y = _data(n)
+    res  = {}
+
+    series = []
+
+    def add(_i):
+        series.append(p.add_lines(X=X, Y=Y))
+    res['add_lines'] = _time(add, _reps(n))
+    for s in series[1:]:
+        s.hide()
+    s = series[0]
+
+    res['snap_bounds'] = _time(lambda _i: p.snap_bounds(), _reps(n))
+
+    def draw(i):
+        ctx.mark_dirty()
+        ctx._draw(i)
+    res['draw'] = _time(draw, max(3, _reps(n)))
+
+    l, r, b, t = p._get_data_bounds()
+    w          = r - l
+
+    def pan(i):
+        d = w * (i + 1) / (10 * PAN_STEPS)
+        for _ in range(PAN_STEPS):
+            p._gen_mvp_from_limits(l + d, r + d, b, t)
+            p._gen_ticks()
+    res['pan'] = _time(pan, 3) / PAN_STEPS
+
+    def zoom(_i):
+        for k in range(PAN_STEPS):
+            z = 0.5**(k / 4)
+            p._gen_mvp_from_limits(l, l + w * z, b, t)
+            p._gen_ticks()
+    res['zoom'] = _time(zoom, 3) / PAN_STEPS
+
+    def replace(i):
+        s.set_x_y_data(*_data(n, i))
+    res['set_x_y_data'] = _time(replace, _reps(n))
+
+    AX = np.arange(APPEND_LEN, dtype=np.float64)
+    AY = np.sin(AX)
+
+    def append(_i):
+        for _ in range(APPEND_COUNT):
+            s.append_x_y_data(AX + len(s.vertices), AY)
+    res['append_x_y_data'] = _time(append, 3) / APPEND_COUNT
+
+    def stream(i):
+        for _ in range(APPEND_COUNT):
+            s.append_x_y_data(AX + len(s.vertices), AY)
+            ctx._draw(i)
+    res['append_draw'] = _time(stream, 3) / APPEND_COUNT
+
+    glotlib.main.CONTEXTS.discard(ctx)
+    return res
+
+
+def run(sizes):
+    egl = glotlib.egl.EGLContext(WIDTH, HEIGHT)
+    glotlib.programs.load()
+    GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+    results = {}
+    for n in sizes:
+        print('Benchmarking %u points...' % n, file=sys.stderr)
+        for name, dt in bench_size(n).items():
+            results.setdefault(name, {})[str(n)] = dt
+
+    meta = {
+        'renderer' : GL.glGetString(GL.GL_RENDERER).decode(),
+        'version'  : GL.glGetString(GL.GL_VERSION).decode(),
+        'python'   : platform.python_version(),
+        'numpy'    : np.__version__,
+        'machine'  : platform.machine(),
+        'time'     : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    egl.destroy()
+    return {'meta' : meta, 'results' : results}
+
+
+def compare(baseline, current, threshold):
+    '''
+    Prints the ratio of each current result to its baseline and returns the
+    list of (name, size, ratio) tuples for those that exceed 1 + threshold.
+    '''
+    regressions = []
+    for name, by_size in sorted(current['results'].items()):
+        for size, dt in sorted(by_size.items(), key=lambda kv: int(kv[0])):
+            base = baseline['results'].get(name, {}).get(size)
+            if not base:
+                continue
+
+            ratio = dt / base
+            flag  = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append((name, size, ratio))
+            print('%-16s %10s %12.6f %12.6f %6.2fx%s' %
+                  (name, size, base, dt, ratio, flag))
+    return regressions
+
+
+def main(args):
+    if args.results:
+        with open(args.results, 'r', encoding='utf8') as f:
+            current = json.load(f)
+    else:
+        sizes   = [int(float(s)) for s in args.sizes.split(',')]
+        current = run(sizes)
+        if args.output:
+            with open(args.output, 'w', encoding='utf8') as f:
+                json.dump(current, f, indent=2)
+        else:
+            json.dump(current, sys.stdout, indent=2)
+            print()
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('renderer') != current['meta'].get('renderer'):
+            print('Warning: baseline renderer %r differs from %r' %
+                  (baseline['meta'].get('renderer'),
+                   current['meta'].get('renderer')), file=sys.stderr)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
+
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help='comma-separated series sizes, in points')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--results',
+                        help='compare this JSON file instead of running')
+    parser.add_argument('--baseline', help='JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown ratio flagged as a regression')
+    main(parser.parse_args())
+
+
+if __name__ == '__main__':
+    _main()
@@ -1,27 +1,42 @@
 from . import miter_lines  # noqa: F401
 from .label import Label
-from .main import (init_fonts, animate, interact, stop, wakeup, get_frame_time,
-                   FPS, get_fps, periodic)
+from .main import (init, init_fonts, animate, interact, stop, wakeup,
+                   get_frame_time, FPS, get_fps, get_frame_histogram,
+                   reset_frame_histogram, periodic)
 from .program import Program
+from .glstate import get_eliminated_calls
+from .frame_stats import get_frame_stats, enable as enable_frame_stats
 from .context import Context
+from .offscreen import OffscreenContext
+from .export import render_batch
 
 from .constants import (  # noqa: F401
     ASPECT_NONE,
     ASPECT_SQUARE,
+    PRECISION_SINGLE,
+    PRECISION_DOUBLE,
 )
 
 
 __all__ = [
     'animate',
     'Context',
+    'enable_frame_stats',
     'FPS',
+    'get_eliminated_calls',
     'get_fps',
+    'get_frame_stats',
+    'get_frame_histogram',
     'get_frame_time',
+    'init',
     'init_fonts',
     'interact',
     'periodic',
+    'reset_frame_histogram',
     'Label',
+    'OffscreenContext',
     'Program',
+    'render_batch',
     'stop',
     'wakeup',
 ]
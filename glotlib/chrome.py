@@ -0,0 +1,142 @@
+import numpy as np
+from OpenGL import GL
+
+from . import vbo
+from . import matrix
+from . import programs
+from . import glstate
+from . import gldispatch
+
+
+QUAD_VERTICES = np.array(
+    [[-1, -1],
+     [ 1, -1],
+     [ 1,  1],
+     [-1, -1],
+     [ 1,  1],
+     [-1,  1],
+     ], dtype=np.float32)
+QUAD_TEX_COORDS = (QUAD_VERTICES + 1) / 2
+
+
+class ChromeLayer:
+    '''
+    Offscreen cache of a plot's static chrome: its border, tick labels and
+    axis labels.  The chrome is rasterized into a texture covering its full
+    extent (see Plot._get_fb_extent()), including the labels that sit in the
+    padding around the plot's grid cell, and each frame then simply blends it
+    into the framebuffer with a single textured quad before the plot's data
+    is drawn on top of it.  The chrome is only rasterized again after
+    invalidate() is called or its extent changes.
+
+    The texture holds premultiplied alpha over a transparent background, so
+    compositing it leaves whatever is underneath, such as a neighbouring
+    plot, intact.  If the framebuffer being drawn to is multisampled, the
+    chrome is rasterized with the same number of samples and resolved into
+    the texture.
+    '''
+    def __init__(self, plot):
+        self.plot     = plot
+        self.valid    = False
+        self.size     = None
+        self.samples  = 0
+        self.fbo      = GL.glGenFramebuffers(1)
+        self.texture  = GL.glGenTextures(1)
+        self.ms_fbo   = None
+        self.ms_rb    = None
+
+        self.vao = GL.glGenVertexArrays(1)
+        glstate.bind_vertex_array(self.vao)
+        self.geom_vbo = vbo.StaticVBO(QUAD_VERTICES)
+        self.geom_vbo._attrib_pointer(0)
+        GL.glEnableVertexAttribArray(0)
+        self.tex_vbo = vbo.StaticVBO(QUAD_TEX_COORDS)
+        self.tex_vbo._attrib_pointer(1)
+        GL.glEnableVertexAttribArray(1)
+        glstate.bind_vertex_array(0)
+
+    def invalidate(self):
+        self.valid = False
+
+    def _alloc(self, w, h, samples):
+        glstate.bind_texture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, w, h, 0, GL.GL_RGBA,
+                        GL.GL_UNSIGNED_BYTE, None)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER,
+                           GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER,
+                           GL.GL_NEAREST)
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
+        GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+                                  GL.GL_TEXTURE_2D, self.texture, 0)
+
+        if samples > 1:
+            if self.ms_fbo is None:
+                self.ms_fbo = GL.glGenFramebuffers(1)
+                self.ms_rb  = GL.glGenRenderbuffers(1)
+            GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.ms_rb)
+            GL.glRenderbufferStorageMultisample(GL.GL_RENDERBUFFER, samples,
+                                                GL.GL_RGBA8, w, h)
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.ms_fbo)
+            GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER,
+                                         GL.GL_COLOR_ATTACHMENT0,
+                                         GL.GL_RENDERBUFFER, self.ms_rb)
+        self.size    = (w, h)
+        self.samples = samples
+
+    def _render(self, x, y, w, h, samples):
+        '''
+        Rasterizes the chrome of the plot into the texture, which covers the
+        (x, y, w, h) framebuffer rectangle.
+        '''
+        context = self.plot.context
+        prev    = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        scissor = GL.glIsEnabled(GL.GL_SCISSOR_TEST)
+
+        if self.size != (w, h) or self.samples != samples:
+            self._alloc(w, h, samples)
+        target = self.ms_fbo if samples > 1 else self.fbo
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, target)
+        gldispatch.glDisable(GL.GL_SCISSOR_TEST)
+        gldispatch.glViewport(0, 0, w, h)
+        GL.glClearColor(0, 0, 0, 0)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+
+        # Accumulate coverage into the alpha channel so that the texture ends
+        # up holding premultiplied alpha.
+        GL.glBlendFuncSeparate(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA,
+                               GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+        mvp = matrix.ortho(x / context.r_w, (x + w) / context.r_w,
+                           y / context.r_h, (y + h) / context.r_h, -1, 1)
+        self.plot._draw_chrome(mvp, (w / context.r_w, h / context.r_h))
+        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+        if target != self.fbo:
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, target)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.fbo)
+            GL.glBlitFramebuffer(0, 0, w, h, 0, 0, w, h,
+                                 GL.GL_COLOR_BUFFER_BIT, GL.GL_NEAREST)
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, prev)
+        if scissor:
+            gldispatch.glEnable(GL.GL_SCISSOR_TEST)
+        self.valid = True
+
+    def draw(self):
+        x, y, w, h = self.plot._get_fb_extent()
+        samples    = int(GL.glGetIntegerv(GL.GL_SAMPLES))
+        if (not self.valid or self.size != (w, h) or
+                self.samples != samples):
+            self._render(x, y, w, h, samples)
+
+        gldispatch.glViewport(x, y, w, h)
+        glstate.active_texture(0)
+        glstate.bind_texture(GL.GL_TEXTURE_2D, self.texture)
+        programs.textured_quad.use(0, np.identity(4, dtype=np.float32), 0)
+        glstate.bind_vertex_array(self.vao)
+        GL.glBlendFunc(GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+        gldispatch.glEnable(GL.GL_BLEND)
+        gldispatch.glDrawArrays(GL.GL_TRIANGLES, 0, len(QUAD_VERTICES))
+        gldispatch.glDisable(GL.GL_BLEND)
+        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
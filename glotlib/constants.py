@@ -1,2 +1,5 @@
 ASPECT_NONE     = 0
 ASPECT_SQUARE   = 1
+
+PRECISION_SINGLE = 0
+PRECISION_DOUBLE = 1
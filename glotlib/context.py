@@ -1,3 +1,5 @@
+import threading
+
 from OpenGL import GL
 
 import glotlib.plot
@@ -6,6 +8,9 @@ from . import matrix
 from . import constants
 from . import fonts
 from . import label
+from . import glstate
+from . import gldispatch
+from . import frame_stats
 
 
 # This is the padding on each side of the flexible window area.  Note that
@@ -88,8 +93,35 @@ def _bounds(b, pad_l=PAD_H, pad_r=PAD_H, pad_b=PAD_V, pad_t=PAD_V):
 
 
 class Context:
+    '''
+    A drawing surface holding a set of plots and labels.
+
+    Changes that only affect a single plot, such as modifying one of its
+    series or panning it, mark just that plot dirty.  By default the whole
+    context is still redrawn whenever anything changes.  With
+    partial_redraw=True, the next frame instead only redraws the rectangle
+    covering the dirty plots and their labels, with a scissor rectangle,
+    leaving the rest of the framebuffer as-is.  This requires a framebuffer
+    whose contents are preserved from one frame to the next, which double
+    buffered windows generally don't guarantee, so only enable it for
+    framebuffers known to preserve their contents, such as a single buffered
+    one or a framebuffer object.  The draw() hook and the context labels are
+    drawn once per frame, clipped to that rectangle; a context whose draw()
+    hook changes by itself should call mark_dirty().
+
+    Full redraws draw over whatever the framebuffer already holds, so that a
+    host that owns the framebuffer can draw its own background first.  Pass
+    clear=True to clear it with clear_color first instead.  Partial redraws
+    always clear the rectangle they redraw with clear_color.
+
+    Data staged from other threads with Series.push_x_y_data() is appended at
+    the start of the next frame, with a single upload per series.
+
+    show_frame_stats() overlays the timing of the draw path, as returned by
+    glotlib.get_frame_stats(), in the top-left corner of the context.
+    '''
     def __init__(self, w, h, x=100, y=100, name='', msaa=None,
-                 clear_color=(1, 1, 1)):
+                 clear_color=(1, 1, 1), partial_redraw=False, clear=False):
         glotlib.main.add_context(self)
 
         # TODO:
@@ -120,15 +152,22 @@ class Context:
         glotlib.init_fonts()
         
         if msaa is not None:
-            GL.glEnable(GL.GL_MULTISAMPLE)
+            gldispatch.glEnable(GL.GL_MULTISAMPLE)
             self.msaa_samples = GL.glGetIntegerv(GL.GL_SAMPLES)
         else:
             self.msaa_samples = None
 
-        self.plots      = []
-        self.labels     = []
-        self._dirty     = True
-        self._iconified = False
+        self.plots          = []
+        self.labels         = []
+        self.clear_color    = clear_color
+        self.clear          = clear
+        self.partial_redraw = partial_redraw
+        self._dirty         = True
+        self._plots_dirty   = False
+        self._iconified     = False
+        self._staged        = []
+        self._staged_lock   = threading.Lock()
+        self.stats_labels   = None
 
     def _destroy(self):
         pass
@@ -143,24 +182,125 @@ class Context:
         self._dirty = True
         self._draw(glotlib.get_frame_time())
 
-    def _draw(self, t):
-        if not self.update_geometry(t) and not self._dirty:
-            return False
-        if self._iconified:
-            return False
-        self._dirty = False
+    def _clear(self):
+        GL.glClearColor(*self.clear_color, 1)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
 
-        for p in self.plots:
-            if p.visible:
-                p.draw(t)
-
-        GL.glViewport(0, 0, self.fb_w, self.fb_h)
+    def _draw_labels(self, t):
+        gldispatch.glViewport(0, 0, self.fb_w, self.fb_h)
         for l in self.labels:
             if l.visible:
                 l.draw(self.mvp)
 
         self.draw(t)
 
+    def _draw_dirty_plots(self, t):
+        '''
+        Clears the rectangle covering the extents of all dirty plots and
+        redraws everything that overlaps it, once, leaving the rest of the
+        framebuffer untouched.
+        '''
+        extents = {p: p._get_fb_extent() for p in self.plots}
+        dirty   = [extents[p] for p in self.plots if p._dirty]
+        if not dirty:
+            return
+
+        x0 = min(x for x, _, _, _ in dirty)
+        y0 = min(y for _, y, _, _ in dirty)
+        x1 = max(x + w for x, _, w, _ in dirty)
+        y1 = max(y + h for _, y, _, h in dirty)
+
+        gldispatch.glEnable(GL.GL_SCISSOR_TEST)
+        gldispatch.glScissor(x0, y0, x1 - x0, y1 - y0)
+        self._clear()
+        for p in self.plots:
+            p._dirty   = False
+            x, y, w, h = extents[p]
+            if p.visible and x < x1 and x0 < x + w and y < y1 and y0 < y + h:
+                p.draw(t)
+        self._draw_labels(t)
+        gldispatch.glDisable(GL.GL_SCISSOR_TEST)
+
+    def _queue_staged(self, s):
+        '''
+        Queues the series s, which has just had data staged, to be flushed at
+        the start of the next frame.  Can be called from any thread.
+        '''
+        with self._staged_lock:
+            self._staged.append(s)
+        glotlib.wakeup()
+
+    def _flush_staged(self):
+        with self._staged_lock:
+            staged, self._staged = self._staged, []
+        for s in staged:
+            s._flush_staged()
+
+    def show_frame_stats(self, show=True):
+        '''
+        Shows or hides an overlay of the frame timing statistics, enabling the
+        timing if necessary.  The overlay is only refreshed when the context
+        is drawn for some other reason, and while it is shown every frame that
+        is drawn redraws the whole context.
+        '''
+        if show:
+            frame_stats.enable()
+            if self.stats_labels is None:
+                self.stats_labels = []
+        elif self.stats_labels is not None:
+            for l in self.stats_labels:
+                self.labels.remove(l)
+            self.stats_labels = None
+        self.mark_dirty()
+
+    def _update_stats_labels(self):
+        stats = frame_stats.get_frame_stats()
+        lines = ['frame %s, GPU frame %s' % (stats['frame'],
+                                             stats['gpu_frame'])]
+        for name in sorted(stats['cpu'], key=stats['cpu'].get, reverse=True):
+            gpu = stats['gpu'].get(name)
+            lines.append('%s x%u: CPU %.3f ms, GPU %s' %
+                         (name, stats['calls'][name], stats['cpu'][name] * 1e3,
+                          '-' if gpu is None else '%.3f ms' % (gpu * 1e3)))
+
+        font = fonts.vera(12, 0)
+        dy   = font.height // (64 * font.oversample) + 2
+        while len(self.stats_labels) < len(lines):
+            y = self.w_h - 4 - len(self.stats_labels) * dy
+            l = label.Label(self, (4, y), '', font=font, anchor='NW')
+            self.stats_labels.append(l)
+            self.labels.append(l)
+        for i, l in enumerate(self.stats_labels):
+            l.set_text(lines[i] if i < len(lines) else '')
+
+    def _draw(self, t):
+        self._flush_staged()
+        full = self.update_geometry(t) or self._dirty
+        if not full and not self._plots_dirty:
+            return False
+        if self._iconified:
+            return False
+        self._dirty       = False
+        self._plots_dirty = False
+
+        token = frame_stats.begin(self, '_draw', gpu=True)
+        glstate.invalidate()
+        if self.stats_labels is not None:
+            self._update_stats_labels()
+            full = True
+        if full or not self.partial_redraw:
+            if self.clear:
+                self._clear()
+            for p in self.plots:
+                p._dirty = False
+                if p.visible:
+                    p.draw(t)
+            self._draw_labels(t)
+        else:
+            self._draw_dirty_plots(t)
+        gldispatch.check_errors()
+        frame_stats.end(token)
+
         self.swap_buffers()
 
         return True
@@ -169,10 +309,19 @@ class Context:
         raise Exception('resize() not supported')
 
     def mark_dirty(self):
+        '''
+        Flags the whole context as needing to be redrawn.  See also
+        Plot.mark_dirty().
+        '''
         if not self._dirty:
             self._dirty = True
             glotlib.wakeup()
 
+    def _mark_plots_dirty(self):
+        if not self._plots_dirty:
+            self._plots_dirty = True
+            glotlib.wakeup()
+
     def update_geometry(self, _t):
         return False
 
@@ -216,6 +365,17 @@ class Context:
         Plot.ASPECT_SQUARE, the latter which enforces the plot's data view
         edges so that squares in the data space are rendered as squares in the
         screen space.
+
+        If batched is True, the vertices of up to 32 plain single-precision
+        series added to the plot are packed into one shared buffer, and their
+        lines are drawn with a single instanced draw call per run of
+        consecutive series (see series_batch.SeriesBatch), which can
+        significantly reduce CPU overhead for plots with many series.
+
+        If cached_chrome is True, the border, tick labels and axis labels of
+        the plot are rasterized into an offscreen texture that is only redrawn
+        when they change, and blended into place each frame (see
+        chrome.ChromeLayer).
         '''
         p = glotlib.plot.Plot(self, bounds=_bounds(bounds), **kwargs)
         self.plots.append(p)
@@ -224,6 +384,7 @@ class Context:
     def set_plot_bounds(self, plot, bounds, **kwargs):
         plot.bounds = _bounds(bounds, **kwargs)
         plot._handle_resize()
+        self.mark_dirty()
 
     def add_label(self, *args, font=None, **kwargs):
         font = font or fonts.vera(12, 0)
@@ -0,0 +1,78 @@
+'''
+Headless GL contexts created through EGL, for rendering without a window
+system, for instance with Mesa's llvmpipe software rasterizer.  PyOpenGL must
+then resolve GL functions through EGL as well, so PYOPENGL_PLATFORM=egl has to
+be set in the environment before OpenGL is first imported.  With Mesa,
+EGL_PLATFORM=surfaceless selects a display that doesn't need an X server and
+LIBGL_ALWAYS_SOFTWARE=1 forces llvmpipe.
+'''
+import ctypes
+
+from OpenGL import EGL
+
+
+CONFIG_ATTRIBS = [
+    EGL.EGL_SURFACE_TYPE,    EGL.EGL_PBUFFER_BIT,
+    EGL.EGL_RED_SIZE,        8,
+    EGL.EGL_GREEN_SIZE,      8,
+    EGL.EGL_BLUE_SIZE,       8,
+    EGL.EGL_ALPHA_SIZE,      8,
+    EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+    EGL.EGL_NONE,
+]
+CONTEXT_ATTRIBS = [
+    EGL.EGL_CONTEXT_MAJOR_VERSION,       3,
+    EGL.EGL_CONTEXT_MINOR_VERSION,       3,
+    EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+    EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+    EGL.EGL_NONE,
+]
+
+
+def _attribs(l):
+    return (EGL.EGLint * len(l))(*l)
+
+
+class EGLContext:
+    '''
+    A GL 3.3 core context with a w x h pbuffer as its default framebuffer.
+    The context is made current on creation.
+    '''
+    def __init__(self, w=1, h=1):
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major),
+                                 ctypes.pointer(minor)):
+            raise Exception('eglInitialize() failed')
+
+        config  = EGL.EGLConfig()
+        nconfig = EGL.EGLint()
+        if (not EGL.eglChooseConfig(self.display, _attribs(CONFIG_ATTRIBS),
+                                    ctypes.pointer(config), 1,
+                                    ctypes.pointer(nconfig)) or
+                not nconfig.value):
+            raise Exception('No suitable EGL config')
+
+        self.surface = EGL.eglCreatePbufferSurface(
+            self.display, config,
+            _attribs([EGL.EGL_WIDTH, w, EGL.EGL_HEIGHT, h, EGL.EGL_NONE]))
+        if not EGL.eglBindAPI(EGL.EGL_OPENGL_API):
+            raise Exception('EGL has no desktop GL support')
+        self.context = EGL.eglCreateContext(self.display, config,
+                                            EGL.EGL_NO_CONTEXT,
+                                            _attribs(CONTEXT_ATTRIBS))
+        if not self.context:
+            raise Exception('Failed to create GL 3.3 core context')
+
+        self.make_current()
+
+    def make_current(self):
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface,
+                                  self.context):
+            raise Exception('eglMakeCurrent() failed')
+
+    def destroy(self):
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE,
+                           EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglDestroySurface(self.display, self.surface)
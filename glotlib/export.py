@@ -0,0 +1,263 @@
+'''
+Batch rendering of plots to images over a pool of worker processes.
+
+Each worker owns a headless EGL context (see glotlib.egl) with its own
+OffscreenContext and a single Plot, created once when the worker starts, so
+fonts and programs are only loaded once per worker and the series buffers
+are reused from one plot to the next.  The series arrays of each plot are
+passed to the workers through shared memory rather than pickled, and the
+rendered image is returned through the same shared memory block.
+
+Plots are sent to the workers in tasks of TASK_LEN plots.  A worker renders
+all the plots of a task before waiting for any of their images, so that
+reading a plot back and writing its PNG file overlap with rendering the
+following plots.
+
+Since the workers import OpenGL themselves, PYOPENGL_PLATFORM=egl should be
+set in the environment before glotlib is first imported.
+'''
+import collections
+import concurrent.futures
+import multiprocessing
+import functools
+import itertools
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+from OpenGL import GL
+
+from . import programs
+from . import colors
+from .offscreen import OffscreenContext
+
+
+# Number of plots rendered by a worker per task.
+TASK_LEN = 4
+
+# Per-worker state, set up by _init_worker().
+_egl     = None
+_context = None
+_plot    = None
+_series  = []
+
+
+def _attach(name):
+    '''
+    Attaches to an existing shared memory block owned by the parent.  The
+    workers share the parent's resource tracker, so on Pythons without the
+    track argument registering the block again is harmless and it must not
+    be unregistered here, or the parent's unlink would trip the tracker.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(w, h, samples, plot_kwargs):
+    global _egl
+    global _context
+    global _plot
+
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+    from . import egl  # pylint: disable=import-outside-toplevel
+
+    _egl = egl.EGLContext(w, h)
+    programs.load()
+    GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+    _context = OffscreenContext(w, h, samples=samples, nwriters=1)
+    _plot    = _context.add_plot(111, **plot_kwargs)
+
+
+def _set_series(shm, layout, specs):
+    color_iter = colors.cycle(colors.tab10)
+    for i, spec in enumerate(specs):
+        (x_offset, n), (y_offset, _) = layout[2 * i:2 * i + 2]
+        X = np.ndarray(n, dtype=np.float64, buffer=shm.buf, offset=x_offset)
+        Y = np.ndarray(n, dtype=np.float64, buffer=shm.buf, offset=y_offset)
+        if i < len(_series):
+            s = _series[i]
+            s.set_x_y_data(X, Y)
+            s.show()
+        else:
+            s = _plot.add_lines(X=X, Y=Y)
+            _series.append(s)
+        del X, Y
+
+        s.color       = colors.make(spec.get('color'), color_iter)
+        s.width       = spec.get('width', 1)
+        s.point_width = spec.get('point_width')
+
+    for s in _series[len(specs):]:
+        s.hide()
+
+
+def _copy_image(shm, offset, image):
+    '''
+    Copies a rendered image into the shared memory block at offset.  This
+    runs on a writer thread of the context, and holds no view of the block
+    once it returns so that the block can be closed.
+    '''
+    out    = np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf,
+                        offset=offset)
+    out[:] = image
+    del out
+
+
+def _render(tasks):
+    '''
+    Renders a list of plots in a worker, returning for each one the path of
+    the PNG file written or None if the image was written to the shared
+    memory block.  Each plot is only queued for reading back, and the images
+    are all waited for at the end, once every plot has been submitted.
+    '''
+    shms    = []
+    results = []
+    try:
+        for name, layout, out_offset, meta in tasks:
+            shm = _attach(name)
+            shms.append(shm)
+            _set_series(shm, layout, meta['series'])
+            _plot.set_x_label(meta.get('x_label', ''))
+            _plot.set_y_label(meta.get('y_label', ''))
+            if meta.get('limits'):
+                l, b, r, t = meta['limits']
+                l, r, b, t = _plot._adjust_lrbt(l, r, b, t)
+                _plot._gen_mvp_from_limits(l, r, b, t)
+                _plot._gen_ticks()
+            else:
+                _plot.snap_bounds()
+
+            if meta.get('path'):
+                _context.render(meta['path'])
+                results.append(meta['path'])
+            else:
+                _context.render(functools.partial(_copy_image, shm,
+                                                  out_offset))
+                results.append(None)
+        return results
+    finally:
+        try:
+            _context.flush()
+        finally:
+            for shm in shms:
+                shm.close()
+
+
+def _pack(spec, w, h):
+    '''
+    Copies the series arrays of spec into a new shared memory block, with room
+    for the rendered image after them unless spec has a path.  Returns the
+    block and the task to send to a worker.
+    '''
+    arrays = []
+    metas  = []
+    for s in spec.get('series', []):
+        if 'points' in s:
+            points = np.asarray(s['points'], dtype=np.float64)
+            X, Y   = points[:, 0], points[:, 1]
+        else:
+            X, Y = s['X'], s['Y']
+        arrays.extend((np.asarray(X, dtype=np.float64),
+                       np.asarray(Y, dtype=np.float64)))
+        metas.append({k: v for k, v in s.items()
+                      if k not in ('X', 'Y', 'points')})
+
+    layout = []
+    offset = 0
+    for A in arrays:
+        layout.append((offset, len(A)))
+        offset += A.nbytes
+    nbytes = offset + (0 if spec.get('path') else w * h * 4)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    for (a_offset, n), A in zip(layout, arrays):
+        np.ndarray(n, dtype=np.float64, buffer=shm.buf, offset=a_offset)[:] = A
+
+    meta           = {k: v for k, v in spec.items() if k != 'series'}
+    meta['series'] = metas
+    return shm, (shm.name, layout, offset, meta)
+
+
+def _unlink(shms):
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+def _collect(shms, future, tasks, w, h):
+    '''
+    Returns the list of results of a task submitted to the workers.
+    '''
+    try:
+        results = []
+        for shm, task, path in zip(shms, tasks, future.result()):
+            if path is not None:
+                results.append(path)
+                continue
+
+            view = np.ndarray((h, w, 4), dtype=np.uint8, buffer=shm.buf,
+                              offset=task[2])
+            results.append(view.copy())
+            del view
+        return results
+    finally:
+        _unlink(shms)
+
+
+def render_batch(specs, w=800, h=600, processes=None, samples=None,
+                 max_pending=None, **plot_kwargs):
+    '''
+    Renders a w x h image of a single plot for each of the plot
+    specifications in the specs iterable, over a pool of processes worker
+    processes, and yields the results in the order of specs.  Each
+    specification is a dict with the following keys, all optional:
+
+        series  - a list of dicts, each holding either X and Y arrays or an
+                  (N, 2) points array, plus optionally color, width and
+                  point_width values as for Plot.add_lines()
+        limits  - the (x0, y0, x1, y1) data limits to view; the plot snaps
+                  to the bounds of its series if not given
+        x_label - the label of the X axis
+        y_label - the label of the Y axis
+        path    - the path of a PNG file to write the image to, in which case
+                  the path is yielded instead of the image
+
+    Images are (h, w, 4) RGBA uint8 arrays stored top row first.  The
+    remaining keyword arguments are passed to Context.add_plot() when the
+    workers create their plot.  At most max_pending plots, by default
+    2 * TASK_LEN per process, are in flight at a time.
+    '''
+    processes   = processes or os.cpu_count()
+    max_pending = max_pending or 2 * TASK_LEN * processes
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+    pending  = collections.deque()
+    npending = 0
+    shms     = []
+    tasks    = []
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(w, h, samples, plot_kwargs))
+    try:
+        for spec in itertools.chain(specs, [None]):
+            if spec is not None:
+                shm, task = _pack(spec, w, h)
+                shms.append(shm)
+                tasks.append(task)
+            if tasks and (spec is None or len(tasks) == TASK_LEN):
+                pending.append((shms, executor.submit(_render, tasks), tasks))
+                npending   += len(tasks)
+                shms, tasks = [], []
+            while pending and (spec is None or npending >= max_pending):
+                results   = _collect(*pending.popleft(), w, h)
+                npending -= len(results)
+                yield from results
+    finally:
+        for _, future, _ in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for task_shms, _, _ in pending:
+            _unlink(task_shms)
+        _unlink(shms)
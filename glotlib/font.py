@@ -1,5 +1,10 @@
 import importlib.resources
+import collections
+import hashlib
+import string
+import atexit
 import sys
+import io
 import os
 
 import numpy as np
@@ -7,6 +12,64 @@ import freetype
 
 from OpenGL import GL
 
+from . import glstate
+
+
+# Number of laid-out strings cached per Font.  Tick labels keep cycling
+# through a small set of strings as a plot is panned, so a modest cache
+# catches nearly all of them.
+LAYOUT_CACHE_SIZE = 256
+
+# Glyphs are rasterized on demand into an atlas texture ATLAS_W texels wide,
+# packed into shelves; the atlas height starts at ATLAS_MIN_H and doubles as
+# needed, and the width doubles if a glyph is wider than the atlas.  New
+# fonts start out with the INITIAL_CHARS, which cover tick labels.
+ATLAS_W       = 512
+ATLAS_MIN_H   = 32
+INITIAL_CHARS = string.digits + string.punctuation + ' e'
+
+# Finished atlases are persisted in CACHE_DIR, keyed by the hash of the font
+# file and the font size, and loaded by later launches instead of being
+# rasterized again.  Set CACHE_DIR to None to disable the cache.  A new atlas
+# is persisted as soon as it is created; glyphs rasterized later, while
+# drawing, are only persisted at exit, so that drawing never waits on disk.
+CACHE_VERSION = 3
+CACHE_DIR     = os.environ.get('GLOTLIB_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'),
+                                            '.cache', 'glotlib'))
+GLYPH_DTYPE   = np.dtype([('c',         '<u4'),
+                          ('bm_left',   '<i4'),
+                          ('bm_top',    '<i4'),
+                          ('bm_width',  '<i4'),
+                          ('bm_height', '<i4'),
+                          ('dx',        '<i4'),
+                          ('tex_x',     '<i4'),
+                          ('tex_y',     '<i4'),
+                          ])
+
+# The corners of a glyph quad, as (x, y) fractions of the glyph size, in the
+# order in which gen_vertices_left() emits the two triangles of each glyph.
+QUAD_CORNERS = np.array(
+    [[0, 0],
+     [1, 1],
+     [0, 1],
+     [0, 0],
+     [1, 0],
+     [1, 1],
+     ], dtype=np.float32)
+
+
+# The fonts with glyphs that were rasterized since their atlas was persisted.
+_unsaved_fonts = set()
+
+
+def _save_caches():
+    for font in list(_unsaved_fonts):
+        font._save_cache()
+
+
+atexit.register(_save_caches)
+
 
 def is_pow2(v):
     '''
@@ -75,91 +138,340 @@ class Glyph:
 
 
 class Font:
-    def __init__(self, tex_data, glyphs, oversample_log2, ascender, height,
-                 size):
-        self.tex_data   = tex_data
-        self.tex_w      = tex_data.shape[1]
-        self.tex_h      = tex_data.shape[0]
-        self.glyphs     = glyphs
+    '''
+    A font size of a Face.  Glyphs are rasterized on demand, the first time
+    they are laid out, and packed into a growable atlas texture; texture
+    coordinates are expressed in texels so that they stay valid as the atlas
+    grows, and the text shader scales them by the current atlas dimensions.
+    New glyphs are only uploaded to the GPU the next time the font is bound.
+
+    The metrics of all glyphs are also stored in numpy tables indexed through
+    glyph_index, so that strings can be laid out with array operations, and
+    the layouts of recently-used strings are kept in an LRU cache.
+    '''
+    def __init__(self, face, size, oversample_log2, ascender, height,
+                 cache_path=None, tex_data=None, records=(), shelf=(0, 0, 0)):
+        self.face       = face
+        self.size       = size
+        self.os_log2    = oversample_log2
         self.oversample = (1 << oversample_log2)
         self.ascender   = ascender
         self.height     = height
-        self.size       = size
+        self.cache_path = cache_path
         self.tex        = GL.glGenTextures(1)
+        self.tex_size   = None
         self.bind_unit  = None
+        self.glyphs     = {}
+        self.records    = []
 
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.tex)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER,
-                           GL.GL_NEAREST)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER,
-                           GL.GL_NEAREST)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_R8, tex_data.shape[1],
-                        tex_data.shape[0], 0, GL.GL_RED, GL.GL_UNSIGNED_BYTE,
-                        tex_data)
+        if tex_data is None:
+            tex_data = np.zeros((ATLAS_MIN_H, ATLAS_W), dtype=np.ubyte)
+        self.tex_data   = tex_data
+        self.dirty_rows = (0, self.tex_h)
+        self.shelf_x, self.shelf_y, self.shelf_h = shelf
+        for r in records:
+            self._add_glyph(chr(r['c']), *(int(v) for v in r.item()[1:]))
+
+        self.layout_cache = collections.OrderedDict()
+        if not len(records):
+            self._rasterize(INITIAL_CHARS)
+            self._save_cache()
+        self._gen_glyph_tables()
+
+    @property
+    def tex_w(self):
+        return self.tex_data.shape[1]
+
+    @property
+    def tex_h(self):
+        return self.tex_data.shape[0]
+
+    def _add_glyph(self, c, bm_left, bm_top, bm_width, bm_height, dx, x, y):
+        do = self.os_log2 / 2
+        self.glyphs[c] = Glyph(bm_left, bm_top, bm_width, bm_height, dx,
+                               x + do, y + do, x + bm_width - do,
+                               y + bm_height - do)
+        self.records.append((ord(c), bm_left, bm_top, bm_width, bm_height, dx,
+                             x, y))
+
+    def _alloc_rect(self, w, h):
+        '''
+        Allocates a w x h rectangle in the atlas, growing it if necessary,
+        and returns the (x, y) position of its top-left texel.
+        '''
+        if w > self.tex_w:
+            tex_data = np.zeros((self.tex_h, ceil_pow2(w)), dtype=np.ubyte)
+            tex_data[:, :self.tex_w] = self.tex_data
+            self.tex_data            = tex_data
+            self.dirty_rows          = (0, self.tex_h)
+
+        if self.shelf_x + w > self.tex_w:
+            self.shelf_x  = 0
+            self.shelf_y += self.shelf_h
+            self.shelf_h  = 0
+
+        x             = self.shelf_x
+        y             = self.shelf_y
+        self.shelf_x += w
+        self.shelf_h  = max(self.shelf_h, h)
+
+        if y + h > self.tex_h:
+            tex_data = np.zeros((ceil_pow2(y + h), self.tex_w),
+                                dtype=np.ubyte)
+            tex_data[:self.tex_h] = self.tex_data
+            self.tex_data         = tex_data
+            self.dirty_rows       = (0, self.tex_h)
+        return x, y
+
+    def _rasterize(self, chars):
+        '''
+        Rasterizes the specified characters into the atlas, flagging it to be
+        persisted at exit.
+        '''
+        for c in chars:
+            if c in self.glyphs:
+                continue
+
+            bitmap, bm_left, bm_top, dx = self.face._render_glyph(
+                self.size, self.os_log2, c)
+            h, w = bitmap.shape
+            x, y = self._alloc_rect(w, h)
+            self.tex_data[y:y + h, x:x + w] = bitmap
+            self._add_glyph(c, bm_left, bm_top, w, h, dx, x, y)
+
+            y0, y1          = self.dirty_rows or (y, y + h)
+            self.dirty_rows = (min(y0, y), max(y1, y + h))
+
+        if self.cache_path:
+            _unsaved_fonts.add(self)
+
+    def _save_cache(self):
+        _unsaved_fonts.discard(self)
+        if not self.cache_path:
+            return
+
+        tmp = '%s.%u.tmp' % (self.cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(f, atlas=self.tex_data,
+                         glyphs=np.array(self.records, dtype=GLYPH_DTYPE),
+                         metrics=np.array((CACHE_VERSION, self.ascender,
+                                           self.height, self.shelf_x,
+                                           self.shelf_y, self.shelf_h)))
+            os.replace(tmp, self.cache_path + '.npz')
+        except OSError:
+            pass
+
+    @staticmethod
+    def from_cache(face, size, oversample_log2, cache_path):
+        '''
+        Returns a Font with the atlas persisted at cache_path, or None if
+        there is no usable persisted atlas.  The atlas and its glyph table are
+        stored in a single file that is replaced atomically, so concurrent
+        writers can never leave a mismatched pair behind.
+        '''
+        try:
+            with np.load(cache_path + '.npz') as cache:
+                tex_data = cache['atlas']
+                records  = cache['glyphs']
+                metrics  = cache['metrics']
+        except (OSError, ValueError, KeyError):
+            return None
+        if (metrics[0] != CACHE_VERSION or records.dtype != GLYPH_DTYPE or
+                tex_data.ndim != 2 or tex_data.shape[1] < ATLAS_W):
+            return None
+
+        shelf = tuple(int(v) for v in metrics[3:6])
+        return Font(face, size, oversample_log2, metrics[1], int(metrics[2]),
+                    cache_path=cache_path, tex_data=tex_data, records=records,
+                    shelf=shelf)
+
+    def _gen_glyph_tables(self):
+        '''
+        Generates the glyph tables, in window units:
+
+            glyph_offsets    - (x, y) offset of the bottom-left of the bitmap
+                               from the pen position
+            glyph_sizes      - (w, h) size of the bitmap
+            glyph_advances   - horizontal pen advance
+            glyph_visible    - True if the glyph has a non-empty bitmap
+            glyph_tex_coords - texel coordinates of the 6 quad vertices
+        '''
+        k  = self.oversample
+        gs = list(self.glyphs.values())
+
+        self.glyph_index      = {c : i for i, c in enumerate(self.glyphs)}
+        self.glyph_sizes      = np.array([(g.bm_width / k, g.bm_height / k)
+                                          for g in gs], dtype=np.float64)
+        self.glyph_offsets    = np.array([(g.bm_left / k, g.bm_top / k)
+                                          for g in gs], dtype=np.float64)
+        self.glyph_offsets   -= self.glyph_sizes * (0, 1)
+        self.glyph_advances   = np.array([g.dx / k for g in gs],
+                                         dtype=np.float64)
+        self.glyph_visible    = np.any(self.glyph_sizes != 0, axis=1)
+        self.glyph_tex_coords = np.array([g.tex_coords for g in gs],
+                                         dtype=np.float32)
+
+    def _upload(self):
+        '''
+        Uploads the rows of the atlas that changed since the last upload,
+        reallocating the texture if the atlas grew.
+        '''
+        glstate.bind_texture(GL.GL_TEXTURE_2D, self.tex)
+        if self.tex_size != self.tex_data.shape:
+            if self.tex_size is None:
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER,
+                                   GL.GL_NEAREST)
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER,
+                                   GL.GL_NEAREST)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_R8, self.tex_w,
+                            self.tex_h, 0, GL.GL_RED, GL.GL_UNSIGNED_BYTE,
+                            np.ascontiguousarray(self.tex_data))
+            self.tex_size = self.tex_data.shape
+        else:
+            y0, y1 = self.dirty_rows
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, y0, self.tex_w, y1 - y0,
+                               GL.GL_RED, GL.GL_UNSIGNED_BYTE,
+                               np.ascontiguousarray(self.tex_data[y0:y1]))
+        self.dirty_rows = None
 
     def bind(self, unit):
-        GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.tex)
+        glstate.active_texture(unit)
+        glstate.bind_texture(GL.GL_TEXTURE_2D, self.tex)
+        if self.dirty_rows:
+            self._upload()
         self.bind_unit = unit
 
     def gen_vertices_left(self, text, dy=1):
         '''
         Generates vertices for left-aligned text, returning a tuple:
 
-            (window vertices, texture coords, window width, window height)
+            (window vertices, texel coords, window width, window height)
 
         For text to grow downwards, set dy = -1.  For text to grow upwards, set
         dy = 1.
+
+        Results are cached, so the returned arrays are shared and read-only.
         '''
-        pen_x      = 0
+        key    = (text, dy)
+        layout = self.layout_cache.get(key)
+        if layout is not None:
+            self.layout_cache.move_to_end(key)
+            return layout
+
+        missing = set(text) - self.glyphs.keys() - {'\n'}
+        if missing:
+            self._rasterize(sorted(missing))
+            self._gen_glyph_tables()
+
+        layout = self._layout_left(text, dy)
+        self.layout_cache[key] = layout
+        if len(self.layout_cache) > LAYOUT_CACHE_SIZE:
+            self.layout_cache.popitem(last=False)
+        return layout
+
+    def _layout_left(self, text, dy):
         pen_y      = 0
         width      = 0
         vertices   = []
         tex_coords = []
-        for c in text:
-            if c == '\n':
-                width  = max(width, pen_x)
-                pen_x  = 0
+        for i, line in enumerate(text.split('\n')):
+            if i:
                 pen_y += dy * (self.height // (64 * self.oversample))
-                continue
 
-            g = self.glyphs[c]
-            w = g.bm_width / self.oversample
-            h = g.bm_height / self.oversample
-            if w or h:
-                x = pen_x + g.bm_left / self.oversample
-                y = pen_y + g.bm_top / self.oversample - h
-                vertices += [(x, y),
-                             (x + w, y + h),
-                             (x, y + h),
-                             (x, y),
-                             (x + w, y),
-                             (x + w, y + h),
-                             ]
-                tex_coords += g.tex_coords
-
-            pen_x += g.dx / self.oversample
-
-        width      = max(width, pen_x)
-        vertices   = np.array(vertices, dtype=np.float32)
-        tex_coords = np.array(tex_coords, dtype=np.float32)
+            I     = np.fromiter((self.glyph_index[c] for c in line),
+                                dtype=np.intp, count=len(line))
+            A     = self.glyph_advances[I]
+            pen_x = np.cumsum(A) - A
+            width = max(width, A.sum())
+
+            V          = self.glyph_visible[I]
+            I          = I[V]
+            pos        = self.glyph_offsets[I]
+            pos[:, 0] += pen_x[V]
+            pos[:, 1] += pen_y
+            vertices.append(pos[:, np.newaxis, :] +
+                            QUAD_CORNERS * self.glyph_sizes[I, np.newaxis, :])
+            tex_coords.append(self.glyph_tex_coords[I])
+
+        vertices   = np.concatenate(vertices).reshape(-1, 2).astype(np.float32)
+        tex_coords = np.concatenate(tex_coords).reshape(-1, 2)
+        vertices.flags.writeable   = False
+        tex_coords.flags.writeable = False
 
         return vertices, tex_coords, width, pen_y + self.ascender
 
 
 class Face:
+    '''
+    A font face, from which Fonts of any size can be created.  The font file
+    is only read the first time a Font is requested, and FreeType is only
+    used when a glyph that is missing from the persisted atlas cache has to
+    be rasterized.
+    '''
     def __init__(self, family, name):
-        if sys.version_info < (3, 9):
-            with importlib.resources.open_binary(
-                    'glotlib.font_files.%s' % family, name) as byte_stream:
-                self.face = freetype.Face(byte_stream)
-        else:
-            name  = os.path.join(family, name)
-            files = importlib.resources.files('glotlib.font_files')
-            with files.joinpath(name).open('rb') as byte_stream:
-                self.face = freetype.Face(byte_stream)
+        self.family = family
+        self.name   = name
+        self.data   = None
+        self.face   = None
+        self.sizes  = {}
+
+    def _get_data(self):
+        if self.data is None:
+            if sys.version_info < (3, 9):
+                self.data = importlib.resources.read_binary(
+                    'glotlib.font_files.%s' % self.family, self.name)
+            else:
+                name      = os.path.join(self.family, self.name)
+                files     = importlib.resources.files('glotlib.font_files')
+                self.data = files.joinpath(name).read_bytes()
+        return self.data
+
+    def _get_face(self):
+        if self.face is None:
+            self.face = freetype.Face(io.BytesIO(self._get_data()))
+        return self.face
+
+    def _cache_path(self, size, oversample_log2):
+        if not CACHE_DIR:
+            return None
+
+        digest = hashlib.sha1(self._get_data()).hexdigest()
+        return os.path.join(CACHE_DIR, 'atlas-%s-%g-%u' %
+                            (digest, size, oversample_log2))
+
+    def _set_size(self, size, oversample_log2):
+        face = self._get_face()
+        face.set_char_size(int(size * 64 * (1 << oversample_log2)))
+        return face
+
+    def _get_ascender(self, size, oversample_log2):
+        '''
+        Returns the ascender used to lay out text, which is the largest
+        bitmap top of all the glyphs of the face, in window units.  The
+        glyphs are rendered but not kept; the result is persisted with the
+        atlas.
+        '''
+        face = self._set_size(size, oversample_log2)
+        asc  = 0
+        for _, ci in face.get_chars():
+            face.load_glyph(ci)
+            asc = max(asc, face.glyph.bitmap_top / (1 << oversample_log2))
+        return asc
+
+    def _render_glyph(self, size, oversample_log2, c):
+        '''
+        Rasterizes the character c, returning a tuple:
 
-        self.sizes = {}
+            (bitmap, bitmap left, bitmap top, advance)
+        '''
+        face = self._set_size(size, oversample_log2)
+        face.load_char(c)
+        g  = face.glyph
+        bm = g.bitmap
+        B  = np.array(bm.buffer, dtype=np.ubyte).reshape(bm.rows, bm.pitch)
+        return B[:, :bm.width], g.bitmap_left, g.bitmap_top, g.advance.x >> 6
 
     def __call__(self, size, oversample_log2=0):
         font = self.sizes.get((size, oversample_log2))
@@ -169,60 +481,13 @@ class Face:
         return font
 
     def _load_size(self, size, oversample_log2):
-        self.face.set_char_size(int(size * 64 * (1 << oversample_log2)))
-
-        rows  = 1
-        x     = 0
-        row_h = 0
-        tex_h = 0
-        asc   = 0
-        for _, ci in self.face.get_chars():
-            self.face.load_glyph(ci)
-            g  = self.face.glyph
-            w  = g.bitmap.width
-            x += w
-            if x > 1024:
-                rows  += 1
-                x      = w
-                tex_h += row_h
-                row_h  = 0
-
-            row_h = max(row_h, g.bitmap.rows)
-            asc   = max(asc, g.bitmap_top / (1 << oversample_log2))
-
-        tex_h    = ceil_pow2(tex_h + row_h)
-        tex_w    = 1024 if rows > 1 else ceil_pow2(x)
-        tex_data = np.zeros((tex_h, tex_w), dtype=np.ubyte)
-
-        x     = 0
-        y     = 0
-        row_h = 0
-        do    = oversample_log2 / 2
-        glyphs = {}
-        for cc, ci in self.face.get_chars():
-            c = chr(cc)
-            self.face.load_glyph(ci)
-            g = self.face.glyph
-
-            w = g.bitmap.width
-            if x + w >= 1024:
-                x     = 0
-                y    += row_h
-                row_h = 0
-            row_h = max(row_h, g.bitmap.rows)
-
-            tex_x = x
-            tex_y = y
-            tex_data[tex_y:tex_y + g.bitmap.rows,
-                     tex_x:tex_x + g.bitmap.width].flat = g.bitmap.buffer
-
-            glyphs[c] = Glyph(g.bitmap_left, g.bitmap_top, w, g.bitmap.rows,
-                              g.advance.x >> 6,
-                              (x + do) / tex_w, (y + do) / tex_h,
-                              (x + w - do) / tex_w,
-                              (y + g.bitmap.rows - do) / tex_h)
-
-            x += w
-
-        return Font(tex_data, glyphs, oversample_log2, asc,
-                    self.face.size.height, size)
+        cache_path = self._cache_path(size, oversample_log2)
+        if cache_path:
+            font = Font.from_cache(self, size, oversample_log2, cache_path)
+            if font is not None:
+                return font
+
+        return Font(self, size, oversample_log2,
+                    self._get_ascender(size, oversample_log2),
+                    self._set_size(size, oversample_log2).size.height,
+                    cache_path=cache_path)
@@ -0,0 +1,142 @@
+'''
+Optional per-frame timing of the draw path, enabled with enable().
+
+Timed sections are delimited with begin() and end().  CPU time is measured
+with time.perf_counter().  The GPU time of sections that issue GL commands is
+measured with a pair of GL_TIMESTAMP queries, since sections nest and GL only
+allows one GL_TIME_ELAPSED query to be active at a time.  The query results
+are only read back READBACK_LATENCY frames later, and only once available, so
+timing never stalls the pipeline; GPU times therefore lag the CPU times by a
+few frames.
+
+The times of all sections with the same name are summed over each frame; see
+get_frame_stats().
+'''
+import collections
+import time
+
+from OpenGL import GL
+
+
+ENABLED          = False
+READBACK_LATENCY = 3
+
+_frame     = 0
+_cpu       = {}
+_queries   = []
+_in_flight = collections.deque()
+_pool      = []
+_stats     = {
+    'frame'     : None,
+    'cpu'       : {},
+    'calls'     : {},
+    'gpu_frame' : None,
+    'gpu'       : {},
+}
+
+
+def enable(enabled=True):
+    global ENABLED
+
+    ENABLED = enabled
+    if not enabled:
+        _cpu.clear()
+        for _, queries in _in_flight:
+            for _, q0, q1 in queries:
+                _pool.extend((q0, q1))
+        _in_flight.clear()
+        for _, q0, q1 in _queries:
+            _pool.extend((q0, q1))
+        _queries.clear()
+
+
+def _gen_query():
+    if not _pool:
+        _pool.extend(int(q) for q in GL.glGenQueries(16))
+    q = _pool.pop()
+    GL.glQueryCounter(q, GL.GL_TIMESTAMP)
+    return q
+
+
+def begin(obj, method, gpu=False):
+    '''
+    Starts timing the section named after obj's class and method, returning
+    a token to pass to end(), or None if timing is disabled.  If gpu is True,
+    the GPU time of the section is measured as well.
+    '''
+    if not ENABLED:
+        return None
+
+    q = _gen_query() if gpu else None
+    return ('%s.%s' % (type(obj).__name__, method), time.perf_counter(), q)
+
+
+def end(token):
+    if token is None:
+        return
+
+    name, t0, q0 = token
+    dt           = time.perf_counter() - t0
+    cpu          = _cpu.setdefault(name, [0, 0])
+    cpu[0]      += dt
+    cpu[1]      += 1
+    if q0 is not None:
+        _queries.append((name, q0, _gen_query()))
+
+
+def _read_back(queries):
+    gpu = {}
+    for name, q0, q1 in queries:
+        t0 = int(GL.glGetQueryObjectui64v(q0, GL.GL_QUERY_RESULT))
+        t1 = int(GL.glGetQueryObjectui64v(q1, GL.GL_QUERY_RESULT))
+        gpu[name] = gpu.get(name, 0) + (t1 - t0) / 1e9
+        _pool.extend((q0, q1))
+    return gpu
+
+
+def end_frame():
+    '''
+    Publishes the CPU times of the frame that was just drawn, and the GPU
+    times of the most recent earlier frame whose queries have completed.
+    '''
+    global _frame
+
+    if not ENABLED:
+        return
+
+    if _cpu:
+        _stats['frame'] = _frame
+        _stats['cpu']   = {name: v[0] for name, v in _cpu.items()}
+        _stats['calls'] = {name: v[1] for name, v in _cpu.items()}
+        _cpu.clear()
+    if _queries:
+        _in_flight.append((_frame, list(_queries)))
+        _queries.clear()
+
+    while _in_flight and _frame - _in_flight[0][0] >= READBACK_LATENCY:
+        frame, queries = _in_flight[0]
+        if not GL.glGetQueryObjectiv(queries[-1][2],
+                                     GL.GL_QUERY_RESULT_AVAILABLE):
+            break
+        _in_flight.popleft()
+        _stats['gpu_frame'] = frame
+        _stats['gpu']       = _read_back(queries)
+
+    _frame += 1
+
+
+def get_frame_stats():
+    '''
+    Returns a dict holding the timing of the last frame drawn while timing was
+    enabled:
+
+        frame     - the number of the frame the CPU times are from
+        cpu       - {section name: CPU seconds}
+        calls     - {section name: number of times the section ran}
+        gpu_frame - the number of the frame the GPU times are from
+        gpu       - {section name: GPU seconds}
+
+    Section names are of the form 'Plot.draw' or 'Series.draw'.
+    '''
+    return {k: (dict(v) if isinstance(v, dict) else v)
+            for k, v in _stats.items()}
@@ -0,0 +1,150 @@
+'''
+Dispatch table for the GL functions called on every frame.
+
+By default these are simply the PyOpenGL functions.  PyOpenGL converts every
+argument, and by default checks glGetError() after every call, which costs
+several microseconds of Python per call.  After glotlib.init(raw_dispatch=True)
+the next load() resolves them instead as raw ctypes entry points that take
+plain integers, floats and pointers, and GL errors are then only checked once
+per frame by check_errors().
+
+The functions must always be called through the module, as in
+gldispatch.glDrawArrays(...), since load() replaces them.
+'''
+import ctypes
+from ctypes import c_int, c_uint, c_float, c_ubyte, c_void_p, c_ssize_t
+
+import numpy as np
+from OpenGL import GL
+from OpenGL import platform
+
+
+# Set by glotlib.init().
+RAW = False
+
+# The GL functions of the per-frame path, with their C argument types.
+ENTRY_POINTS = [
+    ('glUseProgram',            [c_uint]),
+    ('glBindVertexArray',       [c_uint]),
+    ('glActiveTexture',         [c_uint]),
+    ('glBindTexture',           [c_uint, c_uint]),
+    ('glBindBuffer',            [c_uint, c_uint]),
+    ('glBufferSubData',         [c_uint, c_ssize_t, c_ssize_t, c_void_p]),
+    ('glVertexAttribPointer',   [c_uint, c_int, c_uint, c_ubyte, c_int,
+                                 c_void_p]),
+    ('glVertexAttribIPointer',  [c_uint, c_int, c_uint, c_int, c_void_p]),
+    ('glDrawArrays',            [c_uint, c_int, c_int]),
+    ('glDrawArraysInstanced',   [c_uint, c_int, c_int, c_int]),
+    ('glEnable',                [c_uint]),
+    ('glDisable',               [c_uint]),
+    ('glViewport',              [c_int, c_int, c_int, c_int]),
+    ('glScissor',               [c_int, c_int, c_int, c_int]),
+    ('glPointSize',             [c_float]),
+    ('glUniform1i',             [c_int, c_int]),
+    ('glUniform1f',             [c_int, c_float]),
+    ('glUniform2f',             [c_int, c_float, c_float]),
+    ('glUniform4f',             [c_int, c_float, c_float, c_float, c_float]),
+    ('glUniform1iv',            [c_int, c_int, c_void_p]),
+    ('glUniform1fv',            [c_int, c_int, c_void_p]),
+    ('glUniform4fv',            [c_int, c_int, c_void_p]),
+    ('glUniformMatrix4fv',      [c_int, c_int, c_ubyte, c_void_p]),
+]
+
+# The functions taking an array as their last argument, with the dtype that
+# the array must be converted to, or None to keep the dtype of the array.
+ARRAY_ARGS = {
+    'glBufferSubData'    : None,
+    'glUniform1iv'       : np.int32,
+    'glUniform1fv'       : np.float32,
+    'glUniform4fv'       : np.float32,
+    'glUniformMatrix4fv' : np.float32,
+}
+
+glUseProgram           = GL.glUseProgram
+glBindVertexArray      = GL.glBindVertexArray
+glActiveTexture        = GL.glActiveTexture
+glBindTexture          = GL.glBindTexture
+glBindBuffer           = GL.glBindBuffer
+glBufferSubData        = GL.glBufferSubData
+glVertexAttribPointer  = GL.glVertexAttribPointer
+glVertexAttribIPointer = GL.glVertexAttribIPointer
+glDrawArrays           = GL.glDrawArrays
+glDrawArraysInstanced  = GL.glDrawArraysInstanced
+glEnable               = GL.glEnable
+glDisable              = GL.glDisable
+glViewport             = GL.glViewport
+glScissor              = GL.glScissor
+glPointSize            = GL.glPointSize
+glUniform1i            = GL.glUniform1i
+glUniform1f            = GL.glUniform1f
+glUniform2f            = GL.glUniform2f
+glUniform4f            = GL.glUniform4f
+glUniform1iv           = GL.glUniform1iv
+glUniform1fv           = GL.glUniform1fv
+glUniform4fv           = GL.glUniform4fv
+glUniformMatrix4fv     = GL.glUniformMatrix4fv
+
+
+def _get_proc_address(name):
+    addr = platform.PLATFORM.getExtensionProcedure(name.encode())
+    if addr is not None and not isinstance(addr, int):
+        addr = ctypes.cast(addr, c_void_p).value
+    if addr in (None, 0, 1, 2, 3, -1):
+        # wglGetProcAddress() doesn't return the GL 1.1 functions, which are
+        # exported by the GL library itself.
+        try:
+            addr = ctypes.cast(getattr(platform.PLATFORM.GL, name),
+                               c_void_p).value
+        except AttributeError:
+            addr = None
+    if not addr:
+        raise Exception('GL entry point %s not found' % name)
+    return addr
+
+
+def _resolve(name, argtypes):
+    functype = platform.PLATFORM.functionTypeFor(platform.PLATFORM.GL)
+    return functype(None, *argtypes)(_get_proc_address(name))
+
+
+def _array_arg(f, dtype):
+    def call(*args):
+        a = np.ascontiguousarray(args[-1], dtype=dtype)
+        return f(*args[:-1], a.ctypes.data)
+    return call
+
+
+def load():
+    '''
+    Points the dispatch table at either the PyOpenGL functions or the raw
+    entry points, depending on RAW.  The raw entry points belong to the
+    current GL context, so this must be called with a current context.
+    '''
+    g = globals()
+    for name, argtypes in ENTRY_POINTS:
+        if not RAW:
+            g[name] = getattr(GL, name)
+            continue
+
+        f = _resolve(name, argtypes)
+        if name in ARRAY_ARGS:
+            f = _array_arg(f, ARRAY_ARGS[name])
+        g[name] = f
+
+
+def check_errors():
+    '''
+    Raises an Exception listing the pending GL errors, if any.  Only needed
+    with RAW dispatch, since PyOpenGL checks for errors after each call.
+    '''
+    if not RAW:
+        return
+
+    errors = []
+    for _ in range(32):
+        err = GL.glGetError()
+        if err == GL.GL_NO_ERROR:
+            break
+        errors.append('0x%04X' % err)
+    if errors:
+        raise Exception('GL errors during frame: %s' % ', '.join(errors))
@@ -0,0 +1,93 @@
+'''
+Shadow copy of the parts of the GL state that the draw loop changes most
+often: the current program, the bound VAO and the bound textures.  Binding
+something that is already bound is skipped without calling into the driver.
+
+The shadow copy is only valid as long as all of these bindings go through this
+module, and since each GL context has its own state it is reset with
+invalidate() before every context is drawn.  The number of calls eliminated
+during the last frame, including skipped uniform updates, is returned by
+get_eliminated_calls().
+'''
+from OpenGL import GL
+
+from . import gldispatch
+
+
+program          = None
+vao              = None
+active_unit      = None
+textures         = {}
+eliminated       = 0
+frame_eliminated = 0
+
+
+def invalidate():
+    global program
+    global vao
+    global active_unit
+
+    program     = None
+    vao         = None
+    active_unit = None
+    textures.clear()
+
+
+def end_frame():
+    global eliminated
+    global frame_eliminated
+
+    frame_eliminated = eliminated
+    eliminated       = 0
+
+
+def get_eliminated_calls():
+    return frame_eliminated
+
+
+def use_program(shader):
+    global program
+    global eliminated
+
+    if shader == program:
+        eliminated += 1
+        return
+    gldispatch.glUseProgram(shader)
+    program = shader
+
+
+def bind_vertex_array(array):
+    global vao
+    global eliminated
+
+    if array == vao:
+        eliminated += 1
+        return
+    gldispatch.glBindVertexArray(array)
+    vao = array
+
+
+def active_texture(unit):
+    global active_unit
+    global eliminated
+
+    if unit == active_unit:
+        eliminated += 1
+        return
+    gldispatch.glActiveTexture(GL.GL_TEXTURE0 + unit)
+    active_unit = unit
+
+
+def bind_texture(target, texture):
+    '''
+    Binds the texture to the target of the active texture unit.
+    '''
+    global eliminated
+
+    key = (active_unit, target)
+    if active_unit is not None and textures.get(key) == texture:
+        eliminated += 1
+        return
+    gldispatch.glBindTexture(target, texture)
+    if active_unit is not None:
+        textures[key] = texture
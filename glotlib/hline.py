@@ -3,6 +3,8 @@ from OpenGL import GL
 
 from . import vbo
 from . import programs
+from . import glstate
+from . import gldispatch
 
 
 INSTANCE_GEOMETRY = np.array(
@@ -24,7 +26,7 @@ class HLine:
         self.vertices = [(-1, y), (1, y)]
 
         self.line_vao = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.line_vao)
+        glstate.bind_vertex_array(self.line_vao)
 
         self.vert_vbo = vbo.VBO(self.vertices)
         self.vert_vbo._attrib_pointer(0)
@@ -40,7 +42,7 @@ class HLine:
         GL.glEnableVertexAttribArray(2)
         GL.glVertexAttribDivisor(2, 0)
 
-        GL.glBindVertexArray(0)
+        glstate.bind_vertex_array(0)
 
     def renormalize(self):
         y = self.y * self.plot.rmatrix[1][1] + self.plot.rmatrix[1][3]
@@ -56,7 +58,8 @@ class HLine:
         self.vert_vbo.vertices[1][0] = r
         self.vert_vbo._update_vbo()
 
-        GL.glBindVertexArray(self.line_vao)
+        glstate.bind_vertex_array(self.line_vao)
         programs.square_line.use(self.width, z, mvp, color=self.color,
                                  resolution=resolution)
-        GL.glDrawArraysInstanced(GL.GL_TRIANGLES, 0, len(INSTANCE_GEOMETRY), 1)
+        gldispatch.glDrawArraysInstanced(GL.GL_TRIANGLES, 0,
+                                         len(INSTANCE_GEOMETRY), 1)
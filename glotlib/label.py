@@ -1,10 +1,13 @@
 from ctypes import c_void_p
 from enum import IntEnum
 
+import numpy as np
 from OpenGL import GL
 
 from . import matrix
 from . import programs
+from . import glstate
+from . import gldispatch
 
 
 class HAlign(IntEnum):
@@ -33,11 +36,19 @@ ALIGNMENTS = {
 
 
 class Label:
+    '''
+    A single line of text drawn with a Font.  The glyph vertices are kept on
+    the host and are only uploaded to the Label's own buffers when the Label
+    is drawn on its own, so Labels that are only ever drawn through a
+    TextBatch never upload anything themselves.  The version field is
+    incremented whenever the text or placement of the Label changes.
+    '''
     def __init__(self, context, pos, text, font=None, theta=0, anchor='SW',
-                 visible=True):
+                 visible=True, owner=None):
         assert font
 
         self.context   = context
+        self.owner     = owner or context
         self.font      = font
         self.pos       = (round(pos[0]), round(pos[1]))
         self.theta     = theta
@@ -49,18 +60,24 @@ class Label:
         self.valign    = alignment[1]
         self.width     = 0
         self.height    = 0
-        self.nvertices = 0
+        self.nvertices  = 0
+        self.vertices   = None
+        self.tex_coords = None
+        self.stale      = False
+        self.version    = 0
 
         self.vao      = GL.glGenVertexArrays(1)
         self.geom_vbo = GL.glGenBuffers(1)
         self.tex_vbo  = GL.glGenBuffers(1)
 
-        GL.glBindVertexArray(self.vao)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.geom_vbo)
-        GL.glVertexAttribPointer(0, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, c_void_p(0))
+        glstate.bind_vertex_array(self.vao)
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.geom_vbo)
+        gldispatch.glVertexAttribPointer(0, 2, GL.GL_FLOAT, GL.GL_FALSE, 0,
+                                         c_void_p(0))
         GL.glEnableVertexAttribArray(0)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.tex_vbo)
-        GL.glVertexAttribPointer(1, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, c_void_p(0))
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.tex_vbo)
+        gldispatch.glVertexAttribPointer(1, 2, GL.GL_FLOAT, GL.GL_FALSE, 0,
+                                         c_void_p(0))
         GL.glEnableVertexAttribArray(1)
 
         self.set_text(text)
@@ -73,6 +90,14 @@ class Label:
             matrix.rotate(self.theta) @
             matrix.translate(-dx, -dy)
             )
+        self.version += 1
+
+    def _upload(self):
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.geom_vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertices, GL.GL_STATIC_DRAW)
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.tex_vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.tex_coords, GL.GL_STATIC_DRAW)
+        self.stale = False
 
     def set_text(self, text):
         if text == self.text:
@@ -80,24 +105,33 @@ class Label:
 
         vertices, tex_coords, width, height = self.font.gen_vertices_left(text)
 
-        self.text      = text
-        self.nvertices = len(vertices)
-        self.width     = width
-        self.height    = height
-        if self.nvertices:
-            GL.glBindVertexArray(self.vao)
-            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.geom_vbo)
-            GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices, GL.GL_STATIC_DRAW)
-            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.tex_vbo)
-            GL.glBufferData(GL.GL_ARRAY_BUFFER, tex_coords, GL.GL_STATIC_DRAW)
+        self.text       = text
+        self.nvertices  = len(vertices)
+        self.width      = width
+        self.height     = height
+        self.vertices   = vertices
+        self.tex_coords = tex_coords
+        self.stale      = bool(self.nvertices)
 
         self._update_mvp()
         return True
 
     def set_pos(self, pos):
-        self.pos = (int(pos[0]), int(pos[1]))
+        pos = (int(pos[0]), int(pos[1]))
+        if pos == self.pos:
+            return
+
+        self.pos = pos
         self._update_mvp()
 
+    def get_transformed_vertices(self):
+        '''
+        Returns the glyph vertices with the Label's transform applied, in
+        context coordinates.
+        '''
+        M = self.mvp
+        return self.vertices @ M[:2, :2].T + M[:2, 3]
+
     def set_theta(self, theta):
         self.theta = theta
         self._update_mvp()
@@ -106,30 +140,36 @@ class Label:
         if not self.nvertices:
             return
 
+        if self.stale:
+            self._upload()
+
         mvp = mvp @ self.mvp
-        GL.glBindVertexArray(self.vao)
+        glstate.bind_vertex_array(self.vao)
         self.font.bind(0)
         programs.text.use(0, mvp, self.font, color=color)
-        GL.glEnable(GL.GL_BLEND)
-        GL.glDrawArrays(GL.GL_TRIANGLES, 0, self.nvertices)
-        GL.glDisable(GL.GL_BLEND)
+        gldispatch.glEnable(GL.GL_BLEND)
+        gldispatch.glDrawArrays(GL.GL_TRIANGLES, 0, self.nvertices)
+        gldispatch.glDisable(GL.GL_BLEND)
 
     def draw_batched(self, mvp):
         if not self.nvertices or not self.visible:
             return
 
+        if self.stale:
+            self._upload()
+
         mvp = mvp @ self.mvp
         programs.text.uniformMatrix4fv('u_mvp', mvp)
-        GL.glBindVertexArray(self.vao)
-        GL.glDrawArrays(GL.GL_TRIANGLES, 0, self.nvertices)
+        glstate.bind_vertex_array(self.vao)
+        gldispatch.glDrawArrays(GL.GL_TRIANGLES, 0, self.nvertices)
 
     def show(self):
         self.visible = True
-        self.context.mark_dirty()
+        self.owner.mark_dirty()
 
     def hide(self):
         self.visible = False
-        self.context.mark_dirty()
+        self.owner.mark_dirty()
 
 
 class FlexLabel(Label):
@@ -0,0 +1,216 @@
+import numpy as np
+
+from . import vbo
+
+
+# Series shorter than MIN_LEN, 16 samples per pixel column of a TYPICAL_W
+# wide plot, are always drawn from the source vertices, and no level is built
+# with fewer than MIN_BUCKETS buckets since the coarsest useful level needs
+# roughly two buckets per pixel column.
+TYPICAL_W   = 1024
+MIN_LEN     = 16 * TYPICAL_W
+MIN_BUCKETS = 512
+
+# The finest level of the pyramid reduces BASE_LEN source samples into each
+# bucket and every coarser level reduces FACTOR buckets of the level below it.
+# BASE_LEN is chosen so that a series of MIN_LEN samples gets exactly one
+# level of MIN_BUCKETS buckets; finer levels would only be selected when
+# drawing the source vertices is still cheap, and would cost more memory than
+# all the coarser levels together.  Each bucket contributes two vertices to
+# its level: the samples holding the bucket's minimum and maximum Y values,
+# emitted in their original order so that the decimated polyline traces the
+# same envelope as the source data.
+BASE_LEN    = MIN_LEN // MIN_BUCKETS
+FACTOR      = 4
+
+# Source samples are reduced into buckets this many samples at a time, so that
+# a memory-mapped series is paged in gradually and temporaries stay small.
+CHUNK_LEN   = 1 << 20
+
+
+def _group_arg(V, F, op):
+    '''
+    Splits V into consecutive groups of F values, the last of which may be
+    short, and returns the index into V of the value selected by op (either
+    np.argmin or np.argmax) in each group.
+    '''
+    n     = len(V)
+    full  = n // F
+    I     = np.empty(-(-n // F), dtype=np.int64)
+    chunk = max(CHUNK_LEN // F, 1)
+    for g in range(0, full, chunk):
+        g_end       = min(g + chunk, full)
+        W           = np.ascontiguousarray(V[g * F:g_end * F])
+        I[g:g_end]  = op(W.reshape(g_end - g, F), axis=1)
+        I[g:g_end] += np.arange(g * F, g_end * F, F)
+    if len(I) > full:
+        I[full] = full * F + op(V[full * F:])
+    return I
+
+
+class Level:
+    '''
+    A single level of the decimation pyramid.  The imin and imax arrays hold,
+    for each bucket, the index of the source vertex with the minimum and
+    maximum Y value respectively, as int32 unless the series is too long for
+    that.  The level's vertices are uploaded to their own VBO, encoded in the
+    same vertex format as the series' source vertices; no host copy of them is
+    kept since they can always be gathered again from the source vertices.
+    '''
+    def __init__(self, series, bucket_len, dtype):
+        self.series     = series
+        self.bucket_len = bucket_len
+        self.imin       = np.empty(0, dtype=dtype)
+        self.imax       = np.empty(0, dtype=dtype)
+        self._imin      = self.imin
+        self._imax      = self.imax
+        self.vert_vbo   = vbo.DeviceVBO(series.vert_vbo.ncomponents)
+        self.line_vao   = series._gen_line_vao(self.vert_vbo)
+
+    def __len__(self):
+        return len(self.vert_vbo)
+
+    def _indices(self, first=0):
+        '''
+        Returns the source indices of the level's vertices starting at bucket
+        first, two per bucket in source order.
+        '''
+        imin = self.imin[first:]
+        imax = self.imax[first:]
+        I    = np.empty((len(imin), 2), dtype=imin.dtype)
+        np.minimum(imin, imax, out=I[:, 0])
+        np.maximum(imin, imax, out=I[:, 1])
+        return I.ravel()
+
+    def _gen_x_y(self, first=0):
+        '''
+        Gathers the X and Y data coordinates of the level's vertices starting
+        at bucket first.
+        '''
+        V = self.series.vertices[self._indices(first)]
+        return V[:, 0], V[:, 1]
+
+    def update(self, first, imin, imax):
+        '''
+        Replaces all buckets from index first onwards with the new imin and
+        imax bucket indices and uploads the affected vertices.
+        '''
+        n          = first + len(imin)
+        self._imin = vbo.reserve(self._imin, first, n)
+        self._imax = vbo.reserve(self._imax, first, n)
+        self._imin[first:n] = imin
+        self._imax[first:n] = imax
+        self.imin  = self._imin[:n]
+        self.imax  = self._imax[:n]
+
+        if not self.vert_vbo.fits(2 * n):
+            first = 0
+        X, Y = self._gen_x_y(first)
+        self.vert_vbo.set_data(self.series._encode_x_y(X, Y), 2 * first)
+
+    def renormalize(self):
+        self.vert_vbo.set_data(self.series._encode_x_y(*self._gen_x_y()))
+
+    def vertex_range(self, first, end):
+        '''
+        Given a (first, end) range of source vertex indices, returns the range
+        of level vertices covering it, extended by one bucket on either side
+        so that the lines leaving the range are still drawn.
+        '''
+        b_first = max(first // self.bucket_len - 1, 0)
+        b_end   = min(-(-end // self.bucket_len) + 1, len(self.imin))
+        return 2 * b_first, 2 * b_end
+
+
+class Pyramid:
+    '''
+    Min/max level-of-detail pyramid for a Series.  Each level holds a
+    decimated copy of the series that preserves the Y envelope of every bucket
+    of source samples, so that a series with many more samples than there are
+    pixel columns in the plot can be drawn with a number of instances
+    proportional to the plot width rather than to the number of samples.
+
+    The pyramid is updated incrementally: when the series vertices change
+    from some index onwards, only the buckets covering that index and later
+    are recomputed on each level.
+    '''
+    def __init__(self, series):
+        self.series    = series
+        self.levels    = []
+        self.nvertices = 0
+
+    def update(self, index):
+        '''
+        Updates the pyramid after the series vertices were modified from the
+        specified index onwards.
+        '''
+        V              = self.series.vertices
+        N              = len(V)
+        self.nvertices = N
+        if N < MIN_LEN:
+            self.levels = []
+            return
+
+        dtype = np.int32 if N <= np.iinfo(np.int32).max else np.int64
+        if self.levels and self.levels[0].imin.dtype != dtype:
+            self.levels = []
+
+        Y          = V[:, 1]
+        bucket_len = BASE_LEN
+        first      = index // BASE_LEN
+        prev       = None
+        i          = 0
+        while N // bucket_len >= MIN_BUCKETS:
+            if i == len(self.levels):
+                self.levels.append(Level(self.series, bucket_len, dtype))
+                first = 0
+            level = self.levels[i]
+
+            if prev is None:
+                offset = first * bucket_len
+                imin   = _group_arg(Y[offset:], bucket_len, np.argmin) + offset
+                imax   = _group_arg(Y[offset:], bucket_len, np.argmax) + offset
+            else:
+                cmin = prev.imin[first * FACTOR:]
+                cmax = prev.imax[first * FACTOR:]
+                imin = cmin[_group_arg(Y[cmin], FACTOR, np.argmin)]
+                imax = cmax[_group_arg(Y[cmax], FACTOR, np.argmax)]
+            level.update(first, imin, imax)
+
+            prev        = level
+            bucket_len *= FACTOR
+            first      //= FACTOR
+            i          += 1
+
+        del self.levels[i:]
+
+    def renormalize(self):
+        for level in self.levels:
+            level.renormalize()
+
+    def select(self, nvisible=None):
+        '''
+        Returns the coarsest level that still has at least two buckets per
+        pixel column at the plot's current zoom, or None if the source
+        vertices should be drawn instead.  If the number of source vertices
+        in the view is known it can be passed in nvisible; otherwise it is
+        estimated from the X range of the series.
+        '''
+        if not self.levels:
+            return None
+
+        plot = self.series.plot
+        if nvisible is None:
+            l, _, r, _ = self.series.get_bounds()
+            span       = (r - l) * abs(plot.rmatrix[0][0])
+            if not span > 0:
+                return None
+            nvisible = self.nvertices * 2 * plot.mvpi[0][0] / span
+
+        spp   = nvisible / plot.w
+        level = None
+        for l in self.levels:
+            if 2 * l.bucket_len > spp:
+                break
+            level = l
+        return level
@@ -5,6 +5,9 @@ from OpenGL import GL
 
 from . import programs
 from . import fonts
+from . import glstate
+from . import gldispatch
+from . import frame_stats
 
 
 INITED          = False
@@ -12,19 +15,40 @@ FONTS_INITED    = False
 CONTEXTS        = set()
 TASKS           = set()
 FRAME           = 0
+FRAMES_DRAWN    = 0
 T0              = 0
 FPS             = 0
 SHOULD_INTERACT = False
-
-
-def init(): # initialization is done in the widget itself might be redundant
+WAKEUP          = threading.Event()
+
+# FRAME counts the iterations of the frame loop, whether or not anything was
+# drawn in them, while FRAMES_DRAWN only counts the frames in which some
+# context was drawn.  FPS is measured in frames drawn per second.
+
+# While nothing needs to be drawn, the frame loop still wakes up this often to
+# check whether any context should close.
+IDLE_TIMEOUT = 0.1
+
+# FRAME_HIST[i] counts the frames that took from i to i + 1 ms to draw, with
+# the last bin counting all frames taking FRAME_HIST_MS or longer.
+FRAME_HIST_MS = 100
+FRAME_HIST    = [0] * (FRAME_HIST_MS + 1)
+
+
+def init(raw_dispatch=False):
+    '''
+    Initializes glotlib; this is done automatically with the default settings
+    when the first Context is created.  If raw_dispatch is True, the GL
+    functions called on every frame go through raw ctypes entry points
+    instead of PyOpenGL, and GL errors are only checked once per frame; see
+    gldispatch.  The entry points are resolved by the next programs.load().
+    '''
     global INITED
-    # if INITED:
-    #     return
 
     # # TODO: This is where maybe you can init the external framework?
     # # glfw.init()
-    INITED = True
+    gldispatch.RAW = raw_dispatch
+    INITED         = True
 
 
 def init_fonts():
@@ -40,7 +64,8 @@ def init_fonts():
 
 
 def add_context(w):
-    init()
+    if not INITED:
+        init()
     CONTEXTS.add(w)
 
 
@@ -48,7 +73,9 @@ def draw_contexts(t):
     updated = False
 
     for w in CONTEXTS:
-        updated = updated or w._draw(t)
+        updated = w._draw(t) or updated
+    glstate.end_frame()
+    frame_stats.end_frame()
 
     return updated
 
@@ -61,82 +88,132 @@ def get_fps():
     return FPS
 
 
-def animate():
+def get_frame_histogram():
+    '''
+    Returns a list counting the frames drawn by animate() or interact() by how
+    long they took to draw, where entry i counts the frames that took from i
+    to i + 1 ms and the last entry counts all frames that took FRAME_HIST_MS
+    or longer.
+    '''
+    return list(FRAME_HIST)
+
+
+def reset_frame_histogram():
+    FRAME_HIST[:] = [0] * len(FRAME_HIST)
+
+
+def _close_contexts():
+    '''
+    Destroys the contexts that should close, returning True if any contexts
+    remain.
+    '''
+    del_ws = [w for w in CONTEXTS if w.should_close()]
+    for w in del_ws:
+        w._destroy()
+        CONTEXTS.remove(w)
+    return bool(CONTEXTS)
+
+
+def _draw_frame():
     global FRAME
+    global FRAMES_DRAWN
+
+    FRAME += 1
+    t0     = time.perf_counter()
+    if not draw_contexts(time.time() - T0):
+        return False
+
+    dt            = time.perf_counter() - t0
+    FRAMES_DRAWN += 1
+    FRAME_HIST[min(int(dt * 1000), FRAME_HIST_MS)] += 1
+    return True
+
+
+def _run(target_fps, keep_running):
+    '''
+    Draws frames until keep_running() returns False or all contexts have
+    closed.  After a frame in which nothing was drawn the loop blocks until
+    wakeup() is called, and frames are never drawn more often than
+    target_fps, so all the changes made during one frame interval are drawn
+    together in the next frame.  Frames keep being drawn without waiting for
+    a wakeup() as long as some context draws something, which lets contexts
+    animate through update_geometry().
+    '''
     global FPS
     global T0
 
     programs.load()
     GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
 
-    T0     = time.time()
-    fps_f0 = FRAME
-    fps_t0 = T0
-    del_ws = []
+    interval = 1 / target_fps if target_fps else 0
+    T0       = time.time()
+    fps_f0   = FRAMES_DRAWN
+    fps_t0   = time.perf_counter()
+    t_frame  = fps_t0
 
-    draw_contexts(0)
-    while True:
+    WAKEUP.clear()
+    drawn = _draw_frame()
+    while keep_running():
         # TODO: This is where we were polling for events.
         # glfw.poll_events()
 
-        del_ws = [w for w in CONTEXTS if w.should_close()]
-        for w in del_ws:
-            w._destroy()
-            CONTEXTS.remove(w)
-        if not CONTEXTS:
+        if not _close_contexts():
             break
 
-        t = time.time()
-        if not draw_contexts(t - T0):
-            time.sleep(0.005)
-        FRAME += 1
+        if not drawn:
+            WAKEUP.wait(IDLE_TIMEOUT)
+        delay = t_frame + interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        WAKEUP.clear()
+        t_frame = time.perf_counter()
+        drawn   = _draw_frame()
 
-        fps_dt = t - fps_t0
+        fps_dt = t_frame - fps_t0
         if fps_dt < 0.2:
             continue
 
-        fps_df = FRAME - fps_f0
+        fps_df = FRAMES_DRAWN - fps_f0
         FPS    = fps_df / fps_dt
         # print('FPS: %.1f' % FPS)
 
-        fps_f0 = FRAME
-        fps_t0 = t
+        fps_f0 = FRAMES_DRAWN
+        fps_t0 = t_frame
+
+
+def animate(target_fps=60):
+    '''
+    Draws the contexts until they have all closed, redrawing whenever they
+    change but at most target_fps times per second; pass target_fps=None to
+    remove the limit.
+    '''
+    _run(target_fps, lambda: True)
 
     # TODO: This is where we shut down glfw.
     # glfw.terminate()
 
 
-def interact():
-    global T0
+def interact(target_fps=60):
+    '''
+    Like animate(), but also returns when stop() is called.
+    '''
     global SHOULD_INTERACT
 
-    programs.load()
-    GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-
-    T0 = time.time()
-
     SHOULD_INTERACT = True
-    draw_contexts(0)
-    while SHOULD_INTERACT:
-        # TODO: Get a HID event from glfw.
-        # glfw.wait_events()
-
-        del_ws = [w for w in CONTEXTS if w.should_close()]
-        for w in del_ws:
-            w._destroy()
-            CONTEXTS.remove(w)
-        if not CONTEXTS:
-            break
-
-        t = time.time()
-        draw_contexts(t - T0)
+    _run(target_fps, lambda: SHOULD_INTERACT)
 
 
 def wakeup():
+    '''
+    Wakes up the frame loop so that it checks for contexts to redraw.  This
+    can be called from any thread, and is called by mark_dirty().
+    '''
     # TODO: This is where we signaled the interact() thread to check its event
     # queue.
     # glfw.post_empty_event()
-    pass
+    WAKEUP.set()
+
 
 def stop():
     global SHOULD_INTERACT
@@ -156,6 +233,11 @@ def _periodic_thread_func(dt, callback):
 
 
 def periodic(dt, callback):
+    '''
+    Calls callback(t) every dt seconds from a daemon thread.  Since the
+    callback doesn't run on the thread drawing the contexts, it must not touch
+    GL; use Series.push_x_y_data() to feed new data to a series.
+    '''
     t = threading.Thread(target=_periodic_thread_func, args=(dt, callback),
                          daemon=True)
     TASKS.add(t)
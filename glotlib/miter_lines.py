@@ -3,6 +3,8 @@ import numpy as np
 from OpenGL import GL
 
 from . import programs
+from . import glstate
+from . import gldispatch
 
 
 class MiterLines:
@@ -15,9 +17,9 @@ class MiterLines:
         self._update(vertices)
 
     def bind(self, unit):
-        GL.glBindVertexArray(self.vao)
-        GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
-        GL.glBindTexture(GL.GL_TEXTURE_BUFFER, self.texture)
+        glstate.bind_vertex_array(self.vao)
+        glstate.active_texture(unit)
+        glstate.bind_texture(GL.GL_TEXTURE_BUFFER, self.texture)
         GL.glTexBuffer(GL.GL_TEXTURE_BUFFER, GL.GL_RG32F, self.buffer)
         self.bind_unit = unit
 
@@ -26,11 +28,12 @@ class MiterLines:
                                 resolution=resolution)
 
     def draw(self):
-        GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6 * (len(self.vertices) - 3))
+        gldispatch.glDrawArrays(GL.GL_TRIANGLES, 0,
+                                6 * (len(self.vertices) - 3))
 
     def _update(self, vertices):
         self.vertices = vertices
-        GL.glBindBuffer(GL.GL_TEXTURE_BUFFER, self.buffer)
+        gldispatch.glBindBuffer(GL.GL_TEXTURE_BUFFER, self.buffer)
         GL.glBufferData(GL.GL_TEXTURE_BUFFER, vertices, GL.GL_DYNAMIC_DRAW)
 
     def update_points(self, xy_tuples):
@@ -0,0 +1,240 @@
+import collections
+import threading
+import ctypes
+import struct
+import queue
+import zlib
+
+import numpy as np
+from OpenGL import GL
+
+import glotlib.main
+from .context import Context
+
+
+# Number of ns to wait for a readback at a time before checking again.
+FENCE_TIMEOUT = 100000000
+
+PNG_COMPRESSION = 6
+
+
+def write_png(path, image):
+    '''
+    Writes the (h, w, 4) RGBA or (h, w, 3) RGB uint8 image, stored top row
+    first, to path as a PNG file.
+    '''
+    h, w, c = image.shape
+    assert image.dtype == np.uint8 and c in (3, 4)
+
+    rows        = np.zeros((h, 1 + w * c), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(h, w * c)
+
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', crc))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8,
+                                           6 if c == 4 else 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(),
+                                             PNG_COMPRESSION)))
+        f.write(chunk(b'IEND', b''))
+
+
+class OffscreenContext(Context):
+    '''
+    A Context that renders into a w x h framebuffer object instead of a
+    window, for exporting plots as images.  A GL context must be current, for
+    instance a glotlib.egl.EGLContext.
+
+    Each call to render() draws the context and starts reading its pixels
+    back into the next of npbos pixel buffer objects without waiting for the
+    GPU; the pixels of a frame are only mapped once a later frame has been
+    submitted, or when the ring of buffers wraps around, so reading frame N
+    back overlaps with rendering frame N + 1.  The images are then handed to
+    nwriters background threads which either pass them to a callback or
+    write them to a PNG file.  Images are (h, w, 4) RGBA uint8 arrays stored
+    top row first.
+
+    If samples is given, the context is rendered with that many samples per
+    pixel and resolved before being read back.  Unlike a window, the context
+    clears its framebuffer before every frame unless clear=False is passed.
+    '''
+    def __init__(self, w, h, samples=None, npbos=3, nwriters=2, **kwargs):
+        assert npbos >= 2
+        kwargs.setdefault('clear', True)
+        super().__init__(w, h, msaa=1, partial_redraw=False, **kwargs)
+
+        self.samples       = samples
+        self.nbytes        = self.fb_w * self.fb_h * 4
+        self.renderbuffers = []
+        self.fbo           = self._gen_fbo(samples)
+        self.read_fbo      = self._gen_fbo(None) if samples else self.fbo
+
+        self.pbos = [int(b) for b in np.atleast_1d(GL.glGenBuffers(npbos))]
+        for pbo in self.pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.nbytes, None,
+                            GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.pbo_index = 0
+        self.pending   = collections.deque()
+        self.target    = None
+
+        self.queue   = queue.Queue()
+        self.errors  = []
+        self.writers = [threading.Thread(target=self._writer_thread,
+                                         daemon=True)
+                        for _ in range(nwriters)]
+        for t in self.writers:
+            t.start()
+
+    def _gen_fbo(self, samples):
+        fbo = GL.glGenFramebuffers(1)
+        rb  = GL.glGenRenderbuffers(1)
+        self.renderbuffers.append(rb)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, rb)
+        if samples:
+            GL.glRenderbufferStorageMultisample(GL.GL_RENDERBUFFER, samples,
+                                                GL.GL_RGBA8, self.fb_w,
+                                                self.fb_h)
+        else:
+            GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8,
+                                     self.fb_w, self.fb_h)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER,
+                                     GL.GL_COLOR_ATTACHMENT0,
+                                     GL.GL_RENDERBUFFER, rb)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            raise Exception('Incomplete framebuffer: 0x%04X' % status)
+        return fbo
+
+    def _writer_thread(self):
+        while True:
+            image, target = self.queue.get()
+            try:
+                if callable(target):
+                    target(image)
+                else:
+                    write_png(target, image)
+            except Exception as e:  # pylint: disable=broad-except
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def _draw(self, t):
+        prev = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
+        drawn = super()._draw(t)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, prev)
+        return drawn
+
+    @staticmethod
+    def _signaled(fence):
+        return GL.glClientWaitSync(fence, 0, 0) in (GL.GL_ALREADY_SIGNALED,
+                                                    GL.GL_CONDITION_SATISFIED)
+
+    def _complete(self):
+        '''
+        Maps the oldest pending readback, waiting for it if necessary, and
+        queues its image for the writer threads.
+        '''
+        pbo, fence, target = self.pending.popleft()
+        while (GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT,
+                                   FENCE_TIMEOUT) == GL.GL_TIMEOUT_EXPIRED):
+            pass
+        GL.glDeleteSync(fence)
+
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        ptr  = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.nbytes,
+                                   GL.GL_MAP_READ_BIT)
+        addr = ctypes.cast(ptr, ctypes.c_void_p).value
+        data = np.frombuffer((ctypes.c_ubyte * self.nbytes).from_address(addr),
+                             dtype=np.uint8).copy()
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self.queue.put((data.reshape(self.fb_h, self.fb_w, 4)[::-1], target))
+
+    def swap_buffers(self):
+        if self.target is None:
+            return
+
+        if self.samples:
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.read_fbo)
+            GL.glBlitFramebuffer(0, 0, self.fb_w, self.fb_h,
+                                 0, 0, self.fb_w, self.fb_h,
+                                 GL.GL_COLOR_BUFFER_BIT, GL.GL_NEAREST)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.read_fbo)
+
+        if len(self.pending) == len(self.pbos):
+            self._complete()
+        pbo            = self.pbos[self.pbo_index]
+        self.pbo_index = (self.pbo_index + 1) % len(self.pbos)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        GL.glReadPixels(0, 0, self.fb_w, self.fb_h, GL.GL_RGBA,
+                        GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()
+        self.pending.append((pbo, fence, self.target))
+        self.target = None
+
+        # Complete the earlier frames that are already done without waiting
+        # for the one just submitted.
+        while len(self.pending) > 1 and self._signaled(self.pending[0][1]):
+            self._complete()
+
+    def render(self, target):
+        '''
+        Draws the context and queues its image for delivery to target, which
+        is either the path of a PNG file to write or a callable taking the
+        image array.  Images are delivered from a writer thread, in order only
+        if nwriters is 1; call flush() to wait for them.
+        '''
+        self.target = target
+        self.mark_dirty()
+        self._draw(glotlib.get_frame_time())
+
+    def render_to_array(self):
+        '''
+        Draws the context and returns its image, waiting for all the images
+        queued so far to be delivered.
+        '''
+        images = []
+        self.render(images.append)
+        self.flush()
+        return images[0]
+
+    def flush(self):
+        '''
+        Waits until the images of all rendered frames have been delivered,
+        raising the first exception a writer thread ran into, if any.
+        '''
+        while self.pending:
+            self._complete()
+        self.queue.join()
+        if self.errors:
+            e, self.errors = self.errors[0], []
+            raise e
+
+    def should_close(self):
+        return False
+
+    def close(self):
+        '''
+        Delivers the pending images and releases the GL resources of the
+        context.
+        '''
+        self.flush()
+        GL.glDeleteBuffers(len(self.pbos), self.pbos)
+        GL.glDeleteFramebuffers(1, [self.fbo])
+        if self.read_fbo != self.fbo:
+            GL.glDeleteFramebuffers(1, [self.read_fbo])
+        GL.glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+        glotlib.main.CONTEXTS.discard(self)
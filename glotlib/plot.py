@@ -1,20 +1,25 @@
 import math
 
 import numpy as np
-from OpenGL import GL
 
 import glotlib.miter_lines
 from . import matrix
 from . import constants
 from . import ticker
 from . import fonts
-from . import programs
 from . import colors
+from . import gldispatch
+from . import frame_stats
 from .label import Label
 from .series import Series
 from .hline import HLine
 from .vline import VLine
 from .step_series import StepSeries
+from .rolling_series import RollingSeries
+from .scope_series import ScopeSeries
+from .series_batch import SeriesBatch
+from .chrome import ChromeLayer
+from .text_batch import TextBatch
 
 
 PAD_L       = 0.05
@@ -76,7 +81,8 @@ class Plot:
     def __init__(self, context, bounds=(0, 0, 1, 1), limits=None, _colors=None,
                  max_h_ticks=MAX_H_TICKS, max_v_ticks=MAX_V_TICKS,
                  aspect=constants.ASPECT_NONE, sharex=None, sharey=None,
-                 visible=True, label_font=None, border_width=1):
+                 visible=True, label_font=None, border_width=1,
+                 batched=False, cached_chrome=False):
         l, b, r, t = limits if limits else (-1, -1, 1, 1)
 
         self.context        = context
@@ -104,11 +110,14 @@ class Plot:
         self.mvp32          = None
         self.series         = []
         self.graph_artists  = []
+        self.batch          = SeriesBatch(self) if batched else None
         self.border_lines   = glotlib.miter_lines.from_points([(0, 0)] * 6)
         self.border_width   = border_width
+        self.chrome         = ChromeLayer(self) if cached_chrome else None
         self.h_ticks        = []
         self.v_ticks        = []
         self.snapped        = False
+        self._dirty         = False
 
         self.sharex.add(self)
         self.sharey.add(self)
@@ -123,17 +132,21 @@ class Plot:
                                       anchor='E'))
 
         self.x_label = Label(context, (0, 0), '', self.label_font, anchor='N',
-                             visible=False)
+                             visible=False, owner=self)
         self.x_label_side = 'bottom'
         self.y_label = Label(context, (0, 0), '', self.label_font, anchor='S',
-                             visible=False, theta=math.pi / 2)
+                             visible=False, theta=math.pi / 2, owner=self)
         self.y_label_side = 'left'
+        self.text_batch   = TextBatch(self.label_font,
+                                      self.h_ticks + self.v_ticks +
+                                      [self.x_label, self.y_label])
 
         self._gen_bounds()
         l, r, b, t = self._adjust_lrbt(l, r, b, t)
         self._renormalize(l, r, b, t)
         self._gen_ticks()
         self._update_shared_axes()
+        self.mark_dirty()
 
     def _get_data_bounds(self):
         l = self.mvpi[0][3] - self.mvpi[0][0]
@@ -199,6 +212,8 @@ class Plot:
         ps = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
         vs = glotlib.miter_lines.vertices_from_poly_points(ps)
         self.border_lines._update(vs)
+        if self.chrome:
+            self.chrome.invalidate()
 
         x += 0.5
         y += 0.5
@@ -219,6 +234,7 @@ class Plot:
             ga.renormalize()
 
     def _gen_ticks(self):
+        token      = frame_stats.begin(self, '_gen_ticks')
         l, r, b, t = self._get_data_bounds()
 
         ticks, texts = ticker.gen_ticks_and_texts(l, r, Nmax=self.max_h_ticks)
@@ -242,8 +258,11 @@ class Plot:
                 v_t.set_text('')
 
         self._gen_labels()
+        frame_stats.end(token)
 
     def _gen_labels(self):
+        if self.chrome:
+            self.chrome.invalidate()
         if self.x_label_side == 'bottom':
             x_ticks_height = max(h_t.height for h_t in self.h_ticks)
             self.x_label.set_pos((self.x + self.w / 2,
@@ -271,7 +290,7 @@ class Plot:
         self.mvp   = matrix.ortho(ml, mr, mb, mt, -1, 1, dtype=np.float64)
         self.mvpi  = matrix.unortho(ml, mr, mb, mt, -1, 1, dtype=np.float64)
         self.mvp32 = np.array(self.mvp, dtype=np.float32)
-        self.context.mark_dirty()
+        self.mark_dirty()
 
         K         = 2**(23 - 2)
         context_w = self.w
@@ -330,18 +349,30 @@ class Plot:
         return x, y
 
     def _add_series(self, cls, points=None, X=None, Y=None, color=None,
-                    **kwargs):
+                    copy=True, dtype=np.float64, **kwargs):
         color = colors.make(color, self.color_iter)
 
-        if points is not None:
-            vs = np.array(points, dtype=np.float64)
+        if not copy:
+            vs = np.asarray(points) if points is not None else None
+            if (vs is None or vs.ndim != 2 or vs.shape[1] != 2 or
+                    not vs.flags.c_contiguous):
+                raise Exception('copy=False requires a C-contiguous (N, 2) '
+                                'points array')
+        elif points is not None:
+            vs = np.array(points, dtype=dtype)
         else:
-            vs = np.column_stack((X, Y)).astype(np.float64, copy=False)
+            vs = np.column_stack((X, Y)).astype(dtype, copy=False)
+
+        if not copy:
+            kwargs['raw'] = True
+            kwargs.setdefault('lod', False)
 
         s = cls(self, vs, color=color, **kwargs)
         s.renormalize()
         self.series.append(s)
         self.graph_artists.append(s)
+        if self.batch and self.batch.accepts(s):
+            self.batch.add(s)
         return s
 
     def add_lines(self, points=None, **kwargs):
@@ -350,6 +381,27 @@ class Plot:
         be encoded in a list of (x, y) tuples using the points keyword argument,
         or they can be encoded as separate lists of X and Y coordinates using
         the X and Y keyword arguments.
+
+        Pass precision=PRECISION_DOUBLE for data with a large offset relative
+        to the range being viewed, such as epoch timestamps; the series is then
+        stored in split hi/lo float32 format and never needs to be
+        renormalized as the plot pans and zooms.
+
+        For large data sets, pass copy=False with a C-contiguous (N, 2) points
+        array, which may be an np.memmap, to have the series reference the
+        array directly and upload it to the GPU in chunks without making any
+        host copy of it; float32 arrays are uploaded as-is.  Such series
+        don't build a level-of-detail pyramid unless lod=True is passed, since
+        that has to read through all of the data.  They hold raw float32 data
+        coordinates on the GPU rather than renormalized ones, so this is best
+        suited to data without a large offset relative to the range being
+        viewed, and they never write into the array: set_x_data(),
+        set_y_data() and sub_x_y_data() over existing points raise an
+        Exception, while set_x_y_data(), set_points() and appends replace it.
+
+        Alternatively, pass dtype=np.float32 to keep a float32 rather than
+        float64 host copy of the points; the series is otherwise a regular
+        one.
         '''
         return self._add_series(Series, points=points, **kwargs)
 
@@ -359,6 +411,8 @@ class Plot:
         encoded in a list of (x, y) tuples using the points keyword argument,
         or they can be encoded as separate lists of X and Y coordinates using
         the X and Y keyword arguments.
+
+        The copy and dtype keyword arguments are the same as for add_lines().
         '''
         return self._add_series(Series, points=points, width=None,
                                 point_width=width, **kwargs)
@@ -369,6 +423,31 @@ class Plot:
         '''
         return self._add_series(StepSeries, points=points, **kwargs)
 
+    def add_rolling_lines(self, capacity, points=None, **kwargs):
+        '''
+        Adds a set of Lines that keeps only the last capacity points, for
+        strip-chart style streaming.  Once capacity points have been added,
+        each newly-appended point discards the oldest one.  The initial points
+        are optional and are encoded in the same way as for add_lines().
+        '''
+        if points is None and kwargs.get('X') is None:
+            points = np.empty((0, 2))
+        return self._add_series(RollingSeries, points=points,
+                                capacity=capacity, **kwargs)
+
+    def add_scope_lines(self, points=None, nbuffers=3, **kwargs):
+        '''
+        Adds a set of Lines whose points are meant to be replaced as a whole
+        with set_x_y_data() at up to the display rate, like an oscilloscope
+        trace.  The series rotates through nbuffers GPU buffers so that
+        uploading a new trace never waits for the previous one to be drawn.
+        The points are encoded in the same way as for add_lines().
+        '''
+        if points is None and kwargs.get('X') is None:
+            points = np.empty((0, 2))
+        return self._add_series(ScopeSeries, points=points,
+                                nbuffers=nbuffers, **kwargs)
+
     def add_hline(self, y, color=None, **kwargs):
         '''
         Adds a horizontal line at the specified y coordinate.
@@ -396,8 +475,7 @@ class Plot:
             if not s.visible or len(s.vertices) == 0:
                 continue
 
-            sl, sb = np.nanmin(s.vertices, axis=0)
-            sr, st = np.nanmax(s.vertices, axis=0)
+            sl, sb, sr, st = s.get_bounds()
             l = min(l, sl)
             b = min(b, sb)
             r = max(r, sr)
@@ -440,7 +518,7 @@ class Plot:
             self.x_label.hide()
         self.x_label_side = side
         self._gen_labels()
-        self.context.mark_dirty()
+        self.mark_dirty()
 
     def set_y_label(self, t, side='left'):
         self.y_label.set_text(t)
@@ -450,42 +528,103 @@ class Plot:
             self.y_label.hide()
         self.y_label_side = side
         self._gen_labels()
-        self.context.mark_dirty()
+        self.mark_dirty()
 
     def show(self):
         self.visible = True
-        self.context.mark_dirty()
+        self.mark_dirty()
 
     def hide(self):
         self.visible = False
-        self.context.mark_dirty()
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        '''
+        Flags the plot as needing to be redrawn.  Only the dirty plots of a
+        context are redrawn, unless something affecting the whole context
+        changed.
+        '''
+        if not self._dirty:
+            self._dirty = True
+            self.context._mark_plots_dirty()
+
+    def _get_fb_extent(self):
+        '''
+        Returns the (x, y, w, h) framebuffer rectangle covering everything the
+        plot draws: its grid cell plus any tick or axis labels that extend
+        past it into the padding, clamped to the framebuffer.
+        '''
+        context = self.context
+        x0      = self.bounds[0] * context.w_w
+        y0      = self.bounds[1] * context.w_h
+        x1      = self.bounds[2] * context.w_w
+        y1      = self.bounds[3] * context.w_h
+        for l in self.text_batch.labels:
+            if l.visible and l.nvertices:
+                V  = l.get_transformed_vertices()
+                x0 = min(x0, V[:, 0].min())
+                y0 = min(y0, V[:, 1].min())
+                x1 = max(x1, V[:, 0].max())
+                y1 = max(y1, V[:, 1].max())
+
+        x0 = max(math.floor(x0 * context.r_w) - 1, 0)
+        y0 = max(math.floor(y0 * context.r_h) - 1, 0)
+        x1 = min(math.ceil(x1 * context.r_w) + 1, context.fb_w)
+        y1 = min(math.ceil(y1 * context.r_h) + 1, context.fb_h)
+        return x0, y0, max(x1 - x0, 1), max(y1 - y0, 1)
 
     def set_bounds(self, bounds, **kwargs):
         self.context.set_plot_bounds(self, bounds, **kwargs)
 
-    def draw(self, t):
-        GL.glViewport(0, 0, self.context.fb_w, self.context.fb_h)
+    def _draw_chrome(self, mvp, resolution):
+        '''
+        Draws the border, ticks and labels of the plot.  The mvp matrix maps
+        context coordinates to the current viewport, whose size in context
+        units is given by resolution.
+        '''
         self.border_lines.bind(0)
-        self.border_lines.use_program(self.border_width, 0, self.context.mvp,
-                                      (0, 0, 0, 1),
-                                      (self.context.w_w, self.context.w_h))
+        self.border_lines.use_program(self.border_width, 0, mvp, (0, 0, 0, 1),
+                                      resolution)
         self.border_lines.draw()
 
-        self.label_font.bind(0)
-        programs.text.useProgram()
-        programs.text.uniform1f('u_z', 0)
-        programs.text.uniform4f('u_color', 0, 0, 0, 1)
-        programs.text.uniform1i('u_sampler', 0)
-        GL.glEnable(GL.GL_BLEND)
-        for h_t in self.h_ticks:
-            h_t.draw_batched(self.context.mvp)
-        for v_t in self.v_ticks:
-            v_t.draw_batched(self.context.mvp)
-        self.x_label.draw_batched(self.context.mvp)
-        self.y_label.draw_batched(self.context.mvp)
-        GL.glDisable(GL.GL_BLEND)
-
-        GL.glViewport(self.fb_x, self.fb_y, self.fb_w, self.fb_h)
+        self.text_batch.draw(mvp)
+
+    def draw(self, t):
+        token  = frame_stats.begin(self, 'draw', gpu=True)
+        if self.chrome:
+            ctoken = frame_stats.begin(self.chrome, 'draw', gpu=True)
+            self.chrome.draw()
+            frame_stats.end(ctoken)
+        else:
+            gldispatch.glViewport(0, 0, self.context.fb_w, self.context.fb_h)
+            self._draw_chrome(self.context.mvp,
+                              (self.context.w_w, self.context.w_h))
+
+        gldispatch.glViewport(self.fb_x, self.fb_y, self.fb_w, self.fb_h)
+
+        # Runs of consecutive batched series have their lines drawn together
+        # by the batch, in place, so that the z-order is preserved; a batched
+        # series with points ends its run so that they are drawn right after
+        # its lines.
+        run = []
         for ga in self.graph_artists:
+            if getattr(ga, 'batched', False):
+                run.append(ga)
+                if not ga.point_width:
+                    continue
+            if run:
+                self._draw_batch(run, t)
+                run = []
+
             # TODO: I feel like this is where self.mvp32 goes.
+            gtoken = frame_stats.begin(ga, 'draw', gpu=True)
             ga.draw(t, 0, self.mvp, (self.w, self.h))
+            frame_stats.end(gtoken)
+        if run:
+            self._draw_batch(run, t)
+        frame_stats.end(token)
+
+    def _draw_batch(self, series, t):
+        btoken = frame_stats.begin(self.batch, 'draw', gpu=True)
+        self.batch.draw(series, t, 0, self.mvp, (self.w, self.h))
+        frame_stats.end(btoken)
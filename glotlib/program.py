@@ -1,21 +1,206 @@
 import importlib.resources
+import hashlib
+import struct
 import sys
+import os
 
+import numpy as np
 from OpenGL import GL
 from OpenGL.GL import shaders
+from OpenGL.raw.GL.VERSION import GL_4_1
+
+from . import glstate
+from . import gldispatch
+
+
+# Linked program binaries are persisted in CACHE_DIR, keyed by the hash of the
+# shader sources and of the GL renderer and version strings, so that later
+# launches can skip the GLSL compiler entirely.  Set CACHE_DIR to None to
+# disable the cache.
+CACHE_DIR = os.environ.get('GLOTLIB_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'),
+                                        '.cache', 'glotlib'))
+
+# The (format, data) binaries already loaded or linked by this process, so
+# that programs created for later contexts don't even have to go to disk.
+_binaries = {}
+_renderer = None
+
+
+def _apply_defines(text, defines):
+    '''
+    Inserts a #define line for each of the specified preprocessor symbols
+    right after the #version directive of the shader source text.
+    '''
+    if not defines:
+        return text
+
+    lines = text.split('\n')
+    for i, l in enumerate(lines):
+        if l.startswith('#version'):
+            break
+    else:
+        i = -1
+    lines[i + 1:i + 1] = ['#define %s' % d for d in defines]
+    return '\n'.join(lines)
+
+
+def _binaries_supported():
+    return (bool(GL_4_1.glProgramBinary) and
+            GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0)
+
+
+def _binary_key(v_text, f_text):
+    global _renderer
+
+    if _renderer is None:
+        _renderer = (GL.glGetString(GL.GL_RENDERER) + b'\0' +
+                     GL.glGetString(GL.GL_VERSION))
+
+    h = hashlib.sha1(_renderer)
+    h.update(b'\0' + v_text.encode() + b'\0' + f_text.encode())
+    return h.hexdigest()
+
+
+def _load_binary(key):
+    '''
+    Returns the (format, data) program binary cached under key, or None if
+    there is no cached binary.
+    '''
+    if key in _binaries:
+        return _binaries[key]
+    if not CACHE_DIR:
+        return None
+
+    try:
+        with open(os.path.join(CACHE_DIR, 'program-%s.bin' % key), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) <= 4:
+        return None
+
+    binary         = (struct.unpack('<I', data[:4])[0], data[4:])
+    _binaries[key] = binary
+    return binary
+
+
+def _save_binary(key, shader):
+    length = GL.glGetProgramiv(shader, GL.GL_PROGRAM_BINARY_LENGTH)
+    if not length:
+        return
+
+    data = np.empty(length, dtype=np.uint8)
+    fmt  = np.zeros(1, dtype=np.uint32)
+    GL_4_1.glGetProgramBinary(shader, length, None, fmt, data)
+    binary         = (int(fmt[0]), data.tobytes())
+    _binaries[key] = binary
+    if not CACHE_DIR:
+        return
+
+    path = os.path.join(CACHE_DIR, 'program-%s.bin' % key)
+    tmp  = '%s.%u.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<I', binary[0]))
+            f.write(binary[1])
+        os.replace(tmp, path)
+    except OSError:
+        pass
 
 
 class Program:
-    def __init__(self, v_text, f_text, uniforms=None):
-        self.v_shader = shaders.compileShader(v_text, GL.GL_VERTEX_SHADER)
-        self.f_shader = shaders.compileShader(f_text, GL.GL_FRAGMENT_SHADER)
-        self.shader   = shaders.compileProgram(self.v_shader, self.f_shader,
-                                               validate=False)
-        if uniforms:
-            self.uniforms = {u : GL.glGetUniformLocation(self.shader, u)
-                             for u in uniforms}
-        else:
-            self.uniforms = {}
+    '''
+    A linked vertex and fragment shader pair.  If lazy is True, the program
+    is only compiled and linked by its first useProgram() call.
+
+    Where the driver supports program binaries, linked programs are cached in
+    memory and in CACHE_DIR, so the GLSL compiler only runs the first time a
+    given program is linked for a given GL renderer.  A cached binary that the
+    driver rejects, for instance after a driver update, is simply compiled
+    again.
+
+    The value last set for each uniform is remembered, and setting a uniform
+    to the value it already has is skipped; see glstate.
+    '''
+    def __init__(self, v_text, f_text, uniforms=None, defines=None,
+                 lazy=False):
+        self.v_text        = _apply_defines(v_text, defines)
+        self.f_text        = _apply_defines(f_text, defines)
+        self.uniform_names = uniforms or []
+        self.shader        = None
+        self.uniforms      = {}
+        self.values        = {}
+        if not lazy:
+            self._link()
+
+    def _compile(self, retrievable):
+        v_shader = shaders.compileShader(self.v_text, GL.GL_VERTEX_SHADER)
+        f_shader = shaders.compileShader(self.f_text, GL.GL_FRAGMENT_SHADER)
+        shader   = GL.glCreateProgram()
+        GL.glAttachShader(shader, v_shader)
+        GL.glAttachShader(shader, f_shader)
+        if retrievable:
+            GL_4_1.glProgramParameteri(shader,
+                                       GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT,
+                                       GL.GL_TRUE)
+        GL.glLinkProgram(shader)
+        GL.glDetachShader(shader, v_shader)
+        GL.glDetachShader(shader, f_shader)
+        GL.glDeleteShader(v_shader)
+        GL.glDeleteShader(f_shader)
+
+        if GL.glGetProgramiv(shader, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+            log = GL.glGetProgramInfoLog(shader)
+            GL.glDeleteProgram(shader)
+            raise Exception('Program link failed: %s' % log)
+        return shader
+
+    @staticmethod
+    def _link_binary(binary):
+        shader = GL.glCreateProgram()
+        GL_4_1.glProgramBinary(shader, binary[0], binary[1], len(binary[1]))
+        if GL.glGetProgramiv(shader, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+            GL.glDeleteProgram(shader)
+            return None
+        return shader
+
+    def _link(self):
+        shader = None
+        cached = _binaries_supported()
+        if cached:
+            key    = _binary_key(self.v_text, self.f_text)
+            binary = _load_binary(key)
+            if binary is not None:
+                shader = self._link_binary(binary)
+
+        if shader is None:
+            shader = self._compile(cached)
+            if cached:
+                _save_binary(key, shader)
+
+        self.shader   = shader
+        self.uniforms = {u : GL.glGetUniformLocation(shader, u)
+                         for u in self.uniform_names}
+        self.values   = {}
+
+    def _unchanged(self, u, value):
+        '''
+        Records value as the current value of uniform u, returning True if it
+        already was.
+        '''
+        if self.values.get(u) == value:
+            glstate.eliminated += 1
+            return True
+        self.values[u] = value
+        return False
+
+    @staticmethod
+    def _array_value(v):
+        if isinstance(v, np.ndarray):
+            return (v.dtype.str, v.shape, v.tobytes())
+        return tuple(v)
 
     @staticmethod
     def from_resource(anchor, v_path, f_path, **kwargs):
@@ -34,28 +219,53 @@ class Program:
                                      **kwargs)
 
     def useProgram(self):
-        GL.glUseProgram(self.shader)
+        if self.shader is None:
+            self._link()
+        glstate.use_program(self.shader)
 
     def uniform1i(self, u, i):
-        GL.glUniform1i(self.uniforms[u], i)
+        if not self._unchanged(u, i):
+            gldispatch.glUniform1i(self.uniforms[u], i)
 
     def uniform1f(self, u, f):
-        GL.glUniform1f(self.uniforms[u], f)
+        if not self._unchanged(u, f):
+            gldispatch.glUniform1f(self.uniforms[u], f)
 
     def uniform2f(self, u, f0, f1):
-        GL.glUniform2f(self.uniforms[u], f0, f1)
+        if not self._unchanged(u, (f0, f1)):
+            gldispatch.glUniform2f(self.uniforms[u], f0, f1)
 
     def uniform4f(self, u, f0, f1, f2, f3):
-        GL.glUniform4f(self.uniforms[u], f0, f1, f2, f3)
+        if not self._unchanged(u, (f0, f1, f2, f3)):
+            gldispatch.glUniform4f(self.uniforms[u], f0, f1, f2, f3)
+
+    def uniform1iv(self, u, v):
+        if not self._unchanged(u, self._array_value(v)):
+            gldispatch.glUniform1iv(self.uniforms[u], len(v), v)
+
+    def uniform1fv(self, u, v):
+        if not self._unchanged(u, self._array_value(v)):
+            gldispatch.glUniform1fv(self.uniforms[u], len(v), v)
+
+    def uniform4fv(self, u, v):
+        if not self._unchanged(u, self._array_value(v)):
+            gldispatch.glUniform4fv(self.uniforms[u], len(v), v)
 
     def uniformMatrix4fv(self, u, m):
-        GL.glUniformMatrix4fv(self.uniforms[u], 1, GL.GL_TRUE, m)
+        if not self._unchanged(u, self._array_value(m)):
+            gldispatch.glUniformMatrix4fv(self.uniforms[u], 1, GL.GL_TRUE, m)
 
     def attrib_location(self, name):
+        if self.shader is None:
+            self._link()
         return GL.glGetAttribLocation(self.shader, name)
 
 
 class BuiltinProgram(Program):
+    '''
+    One of the glotlib shader programs, which are all created by
+    programs.load() but only compiled on first use.
+    '''
     def __init__(self, v_path, f_path, **kwargs):
         if sys.version_info < (3, 9):
             v_text = importlib.resources.read_text('glotlib.shaders', v_path)
@@ -64,4 +274,4 @@ class BuiltinProgram(Program):
             files  = importlib.resources.files('glotlib.shaders')
             v_text = files.joinpath(v_path).read_text()
             f_text = files.joinpath(f_path).read_text()
-        super().__init__(v_text, f_text, **kwargs)
+        super().__init__(v_text, f_text, lazy=True, **kwargs)
@@ -1,4 +1,5 @@
 from .program import BuiltinProgram
+from . import gldispatch
 
 
 miter_line  = None
@@ -6,6 +7,13 @@ square_line = None
 frag_points = None
 text        = None
 
+square_line_hilo = None
+frag_points_hilo = None
+step_line        = None
+step_line_hilo   = None
+batch_line       = None
+textured_quad    = None
+
 
 class MiterLineProgram(BuiltinProgram):
     UNIFORMS = [
@@ -39,9 +47,9 @@ class SquareLineProgram(BuiltinProgram):
         'u_color',
     ]
 
-    def __init__(self):
+    def __init__(self, **kwargs):
         super().__init__('square_instanced_line.vert', 'frag.frag',
-                         uniforms=self.UNIFORMS)
+                         uniforms=self.UNIFORMS, **kwargs)
 
     def use(self, width, z, mvp, color=(0, 0, 0, 1), resolution=None):
         self.useProgram()
@@ -59,8 +67,9 @@ class FragPointsProgram(BuiltinProgram):
         'u_color',
     ]
 
-    def __init__(self):
-        super().__init__('mvp_z.vert', 'points.frag', uniforms=self.UNIFORMS)
+    def __init__(self, **kwargs):
+        super().__init__('mvp_z.vert', 'points.frag', uniforms=self.UNIFORMS,
+                         **kwargs)
 
     def use(self, z, mvp, color=(0, 0, 0, 1)):
         self.useProgram()
@@ -69,12 +78,106 @@ class FragPointsProgram(BuiltinProgram):
         self.uniformMatrix4fv('u_mvp', mvp)
 
 
+class SquareLineHiLoProgram(SquareLineProgram):
+    '''
+    Instanced line program for split-precision vertices, where each
+    coordinate is stored as a float32 hi/lo pair.  The mvp matrix maps
+    coordinates relative to the origin point, which is itself uploaded as a
+    hi/lo pair.
+    '''
+    UNIFORMS = SquareLineProgram.UNIFORMS + [
+        'u_origin_hi',
+        'u_origin_lo',
+    ]
+
+    def __init__(self, defines=()):
+        super().__init__(defines=['HILO'] + list(defines))
+
+    def use(self, width, z, mvp, color=(0, 0, 0, 1), resolution=None,
+            origin=((0, 0), (0, 0))):
+        super().use(width, z, mvp, color=color, resolution=resolution)
+        self.uniform2f('u_origin_hi', *origin[0])
+        self.uniform2f('u_origin_lo', *origin[1])
+
+
+class BatchLineProgram(BuiltinProgram):
+    '''
+    Instanced line program that draws the lines of up to MAX_SERIES series
+    packed into one buffer with a single draw call, with the width and color
+    of each series held in uniform arrays and selected by a per-vertex slot
+    attribute.  See series_batch.SeriesBatch.
+    '''
+    MAX_SERIES = 32
+    UNIFORMS   = [
+        'u_mvp',
+        'u_resolution',
+        'u_z',
+        'u_widths',
+        'u_colors',
+    ]
+
+    def __init__(self):
+        super().__init__('square_instanced_line.vert', 'frag.frag',
+                         uniforms=self.UNIFORMS,
+                         defines=['BATCH', 'MAX_SERIES %u' % self.MAX_SERIES])
+
+    def use(self, z, mvp, resolution):
+        self.useProgram()
+        self.uniform1f('u_z', z)
+        self.uniformMatrix4fv('u_mvp', mvp)
+        self.uniform2f('u_resolution', *resolution)
+
+    def set_series(self, widths, colors):
+        '''
+        Sets the width and (R, G, B, A) color of the series in each slot.
+        '''
+        self.uniform1fv('u_widths', widths)
+        self.uniform4fv('u_colors', colors)
+
+
+class StepLineProgram(SquareLineProgram):
+    '''
+    Instanced line program that draws each instance as a vertical segment
+    followed by a horizontal one, so that steps can be drawn directly from the
+    step points.  Requires the 12-vertex step instance geometry.
+    '''
+    def __init__(self):
+        super().__init__(defines=['STEP'])
+
+
+class StepLineHiLoProgram(SquareLineHiLoProgram):
+    '''
+    Step program for split-precision vertices; see SquareLineHiLoProgram.
+    '''
+    def __init__(self):
+        super().__init__(defines=['STEP'])
+
+
+class FragPointsHiLoProgram(FragPointsProgram):
+    '''
+    Point program for split-precision vertices; see SquareLineHiLoProgram.
+    '''
+    UNIFORMS = FragPointsProgram.UNIFORMS + [
+        'u_origin_hi',
+        'u_origin_lo',
+    ]
+
+    def __init__(self):
+        super().__init__(defines=['HILO'])
+
+    def use(self, z, mvp, color=(0, 0, 0, 1), origin=((0, 0), (0, 0))):
+        super().use(z, mvp, color=color)
+        self.uniform2f('u_origin_hi', *origin[0])
+        self.uniform2f('u_origin_lo', *origin[1])
+
+
 class TextProgram(BuiltinProgram):
     UNIFORMS = [
         'u_mvp',
         'u_z',
         'u_color',
         'u_sampler',
+        'u_tex_scale',
     ]
 
     def __init__(self):
@@ -86,15 +189,59 @@ class TextProgram(BuiltinProgram):
         self.uniform4f('u_color', *color)
         self.uniformMatrix4fv('u_mvp', mvp)
         self.uniform1i('u_sampler', font.bind_unit)
+        self.uniform2f('u_tex_scale', 1 / font.tex_w, 1 / font.tex_h)
+
+
+class TexturedQuadProgram(BuiltinProgram):
+    '''
+    Draws geometry textured with the RGBA contents of a 2D texture.
+    '''
+    UNIFORMS = [
+        'u_mvp',
+        'u_z',
+        'u_sampler',
+        'u_tex_scale',
+    ]
+
+    def __init__(self):
+        super().__init__('text.vert', 'texture.frag', uniforms=self.UNIFORMS)
+
+    def use(self, z, mvp, unit):
+        self.useProgram()
+        self.uniform1f('u_z', z)
+        self.uniformMatrix4fv('u_mvp', mvp)
+        self.uniform1i('u_sampler', unit)
+        self.uniform2f('u_tex_scale', 1, 1)
 
 
 def load():
+    '''
+    Creates the builtin programs for the current context.  This is cheap: each
+    program is only compiled the first time it is used, and then normally
+    from a cached program binary.  This also resolves the GL entry points of
+    the gldispatch table for the current context.
+    '''
     global miter_line
     global square_line
     global frag_points
     global text
+    global square_line_hilo
+    global frag_points_hilo
+    global step_line
+    global step_line_hilo
+    global batch_line
+    global textured_quad
+
+    gldispatch.load()
 
     miter_line  = MiterLineProgram()
     square_line = SquareLineProgram()
     frag_points = FragPointsProgram()
     text        = TextProgram()
+
+    square_line_hilo = SquareLineHiLoProgram()
+    frag_points_hilo = FragPointsHiLoProgram()
+    step_line        = StepLineProgram()
+    step_line_hilo   = StepLineHiLoProgram()
+    batch_line       = BatchLineProgram()
+    textured_quad    = TexturedQuadProgram()
@@ -0,0 +1,190 @@
+import numpy as np
+from OpenGL import GL
+
+from . import series
+from . import constants
+from . import programs
+from . import glstate
+from . import gldispatch
+
+
+# The ring slots are grouped into blocks of BOUNDS_BLOCK_LEN slots whose data
+# bounds are cached, so that writing k slots only rescans the blocks holding
+# them and get_bounds() only has to combine capacity / BOUNDS_BLOCK_LEN
+# cached bounds.
+BOUNDS_BLOCK_LEN = 1024
+
+
+class RollingSeries(series.Series):
+    '''
+    A Series that holds at most capacity vertices in a fixed-size circular
+    buffer, for strip-chart style streaming.  Once the buffer is full, each
+    appended vertex overwrites the oldest one, so memory use stays constant
+    and the cost of an append is proportional to the number of new vertices:
+    only the slots that were written are uploaded to the GPU.
+
+    The GPU buffer holds one extra slot after the last one that mirrors the
+    first slot, so that the line segment wrapping around from the end of the
+    buffer to its start can be drawn like any other.  The lines are then
+    drawn as at most two contiguous runs of instances.
+
+    The vertices field holds the filled slots of the ring in storage order,
+    not in the order in which they were appended.
+
+    Since appends evict the oldest vertices, the data bounds are cached per
+    block of ring slots rather than for the series as a whole.
+    '''
+    BATCHABLE = False
+
+    def __init__(self, plot, vertices, capacity=None, raw=False,
+                 precision=constants.PRECISION_SINGLE, lod=False, **kwargs):
+        if capacity is None or capacity < 2:
+            raise Exception('Rolling series require a capacity of at least 2')
+        if raw:
+            raise Exception('Raw vertices not supported for rolling series')
+        if precision != constants.PRECISION_SINGLE:
+            raise Exception('Rolling series only support single precision')
+        if lod:
+            raise Exception('LOD not supported for rolling series')
+
+        self.capacity     = capacity
+        self.ring         = np.empty((capacity, 2), dtype=np.float64)
+        self.head         = 0
+        self.count        = 0
+        self.block_bounds = np.empty((-(-capacity // BOUNDS_BLOCK_LEN), 4))
+
+        super().__init__(plot, self.ring[:0], lod=False, **kwargs)
+        self.vert_vbo.set_data(np.zeros((capacity + 1, 2), dtype=np.float32))
+        self._write(vertices[:, 0], vertices[:, 1])
+
+    def _write(self, X, Y):
+        '''
+        Writes the new X and Y values into the ring starting at the head slot,
+        wrapping around to the start of the ring as necessary, and uploads the
+        slots that were written.
+        '''
+        X = np.asarray(X, dtype=np.float64)[-self.capacity:]
+        Y = np.asarray(Y, dtype=np.float64)[-self.capacity:]
+        if len(X) == 0:
+            return
+
+        VX  = X * self.plot.rmatrix[0][0]
+        VX += self.plot.rmatrix[0][3]
+        VY  = Y * self.plot.rmatrix[1][1]
+        VY += self.plot.rmatrix[1][3]
+
+        head     = self.head
+        n0       = min(len(X), self.capacity - head)
+        n1       = len(X) - n0
+        vertices = self.vert_vbo.vertices
+
+        self.ring[head:head + n0, 0] = X[:n0]
+        self.ring[head:head + n0, 1] = Y[:n0]
+        vertices[head:head + n0, 0]  = VX[:n0]
+        vertices[head:head + n0, 1]  = VY[:n0]
+        self.vert_vbo._sub_vbo_range(head, n0)
+
+        if n1:
+            self.ring[:n1, 0] = X[n0:]
+            self.ring[:n1, 1] = Y[n0:]
+            vertices[:n1, 0]  = VX[n0:]
+            vertices[:n1, 1]  = VY[n0:]
+            self.vert_vbo._sub_vbo_range(0, n1)
+
+        if head == 0 or n1:
+            vertices[self.capacity] = vertices[0]
+            self.vert_vbo._sub_vbo_range(self.capacity, 1)
+
+        self.head     = (head + len(X)) % self.capacity
+        self.count    = min(self.count + len(X), self.capacity)
+        self.vertices = self.ring[:self.count]
+
+        self._update_block_bounds(head, head + n0)
+        if n1:
+            self._update_block_bounds(0, n1)
+        self.plot.mark_dirty()
+
+    def _update_block_bounds(self, first, end):
+        '''
+        Recomputes the cached bounds of the blocks holding ring slots in the
+        range [first, end).
+        '''
+        b0 = first // BOUNDS_BLOCK_LEN
+        b1 = -(-end // BOUNDS_BLOCK_LEN)
+        V  = self.ring[b0 * BOUNDS_BLOCK_LEN:
+                       min(b1 * BOUNDS_BLOCK_LEN, self.count)]
+        I  = np.arange(0, len(V), BOUNDS_BLOCK_LEN)
+        self.block_bounds[b0:b1, :2] = np.fmin.reduceat(V, I, axis=0)
+        self.block_bounds[b0:b1, 2:] = np.fmax.reduceat(V, I, axis=0)
+
+    def get_bounds(self):
+        if self.count == 0:
+            return (np.inf, np.inf, -np.inf, -np.inf)
+
+        B    = self.block_bounds[:-(-self.count // BOUNDS_BLOCK_LEN)]
+        l, b = np.fmin.reduce(B[:, :2], axis=0)
+        r, t = np.fmax.reduce(B[:, 2:], axis=0)
+        return l, b, r, t
+
+    def renormalize(self):
+        if self.count == 0:
+            return
+
+        rmatrix  = self.plot.rmatrix
+        vertices = self.vert_vbo.vertices
+        vertices[:self.count, 0]  = self.vertices[:, 0] * rmatrix[0][0]
+        vertices[:self.count, 0] += rmatrix[0][3]
+        vertices[:self.count, 1]  = self.vertices[:, 1] * rmatrix[1][1]
+        vertices[:self.count, 1] += rmatrix[1][3]
+        vertices[self.capacity]   = vertices[0]
+        self.vert_vbo._update_vbo()
+
+    def set_x_data(self, X):
+        raise Exception('set_x_data() not supported on RollingSeries')
+
+    def set_y_data(self, Y):
+        raise Exception('set_y_data() not supported on RollingSeries')
+
+    def set_x_y_data(self, X, Y):
+        '''
+        Discards all vertices and replaces them with the last capacity
+        entries of X and Y.
+        '''
+        self.head     = 0
+        self.count    = 0
+        self.vertices = self.ring[:0]
+        self._write(X, Y)
+
+    def sub_x_y_data(self, index, X, Y):
+        raise Exception('sub_x_y_data() not supported on RollingSeries')
+
+    def append_x_y_data(self, X, Y):
+        self._write(X, Y)
+
+    def draw(self, _t, z, mvp, resolution):
+        if not self.visible:
+            return
+
+        if self.width and self.count >= 2:
+            programs.square_line.use(self.width, z, mvp, color=self.color,
+                                     resolution=resolution)
+            if self.count < self.capacity:
+                self._draw_line_instances(self.line_vao, self.vert_vbo, 0,
+                                          self.count - 1)
+            else:
+                # The oldest vertex is in the head slot; draw the capacity - 1
+                # segments that follow it, skipping the segment that would
+                # join the newest vertex back to the oldest one.
+                n0 = min(self.capacity - 1, self.capacity - self.head)
+                n1 = self.capacity - 1 - n0
+                self._draw_line_instances(self.line_vao, self.vert_vbo,
+                                          self.head, n0)
+                if n1:
+                    self._draw_line_instances(self.line_vao, self.vert_vbo, 0,
+                                              n1)
+
+        if self.point_width and self.count >= 1:
+            glstate.bind_vertex_array(self.point_vao)
+            programs.frag_points.use(z, mvp, color=self.color)
+            gldispatch.glPointSize(self.point_width * self.plot.context.r_w)
+            gldispatch.glDrawArrays(GL.GL_POINTS, 0, self.count)
@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+
+from . import vbo
+from . import series
+
+
+class ScopeSeries(series.Series):
+    '''
+    A Series for oscilloscope-style display, where the whole trace is
+    replaced with set_x_y_data() at up to the display rate.  The series
+    rotates through nbuffers VBOs, each with its own VAOs, and each
+    replacement goes into the least-recently drawn one after orphaning its
+    storage, so uploading a new trace never has to wait for the GPU to finish
+    drawing the previous ones.
+
+    Partial updates such as append_x_y_data() modify the current VBO in place
+    and don't rotate.
+
+    Since a level-of-detail pyramid would have to be rebuilt on every
+    replacement, and its level VBOs are not rotated, lod defaults to False.
+    Scope series are not batched either, since the batch would have to follow
+    the rotation.
+
+    Both set_x_y_data() and set_points() replace the whole trace and rotate
+    once per call.
+
+    get_upload_rate() reports the rate at which the host replaces traces, in
+    MB/s of vertex data: the bytes uploaded over the wall time spent in the
+    replacements, which covers encoding the vertices and handing them to the
+    driver.  If an upload had to wait for the GPU to finish drawing from the
+    buffer, that wait would count too, so the rate shows whether the rotation
+    keeps uploads from stalling.  The transfer to the GPU itself happens
+    later, asynchronously, and GL offers no reliable way to time it, so it is
+    not part of the rate.
+    '''
+    BATCHABLE = False
+
+    def __init__(self, plot, vertices, nbuffers=3, lod=False, **kwargs):
+        assert nbuffers >= 1
+
+        super().__init__(plot, vertices, lod=lod, **kwargs)
+
+        self.buffers = [(self.vert_vbo, self.line_vao, self.point_vao)]
+        for _ in range(nbuffers - 1):
+            vert_vbo = vbo.VBO(np.empty((0, self.vert_vbo.ncomponents)))
+            self.buffers.append((vert_vbo, self._gen_line_vao(vert_vbo),
+                                 self._gen_point_vao(vert_vbo)))
+        self.buffer_index = 0
+        self.replacing    = False
+        self.reset_upload_stats()
+
+    def _replace(self, replace, *args):
+        '''
+        Replaces the whole trace by calling replace(*args) after switching to
+        the next VBO in the rotation, timing the upload.  Series.set_x_y_data()
+        and Series.set_points() call each other for some vertex formats, so
+        nested replacements don't rotate again.
+        '''
+        if self.replacing:
+            replace(*args)
+            return
+
+        t0             = time.perf_counter()
+        self.replacing = True
+        try:
+            self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+            self.vert_vbo, self.line_vao, self.point_vao = (
+                self.buffers[self.buffer_index])
+            self.vert_vbo.orphan()
+            replace(*args)
+        finally:
+            self.replacing = False
+
+        self.upload_time  += time.perf_counter() - t0
+        self.upload_bytes += (4 * self.vert_vbo.ncomponents *
+                              len(self.vert_vbo))
+
+    def set_x_y_data(self, X, Y):
+        '''
+        Replaces the whole trace, uploading it into the next VBO in the
+        rotation.
+        '''
+        self._replace(super().set_x_y_data, X, Y)
+
+    def set_points(self, points):
+        '''
+        Replaces the whole trace with the (N, 2) points array, uploading it
+        into the next VBO in the rotation.
+        '''
+        self._replace(super().set_points, points)
+
+    def get_upload_rate(self):
+        '''
+        Returns the average rate at which whole traces were replaced, in MB/s
+        of vertex data, since the series was created or since the last call
+        to reset_upload_stats().
+        '''
+        if not self.upload_time:
+            return 0
+        return self.upload_bytes / self.upload_time / 1e6
+
+    def reset_upload_stats(self):
+        self.upload_bytes = 0
+        self.upload_time  = 0
@@ -1,8 +1,15 @@
+import threading
+
 import numpy as np
 from OpenGL import GL
 
 from . import vbo
+from . import matrix
+from . import constants
 from . import programs
+from . import glstate
+from . import gldispatch
+from .lod import Pyramid
 
 
 INSTANCE_GEOMETRY = np.array(
@@ -23,48 +30,269 @@ class Series:
 
     Setters are provided so that the underlying vertices can be updated
     dynamically by the client.
+
+    As in the VBO, the vertices field is a view of the filled prefix of a
+    backing array that grows by doubling, so appends cost amortized O(k).
+
+    Long line series also maintain a min/max level-of-detail pyramid (see
+    lod.Pyramid) so that the number of line instances drawn depends on the
+    width of the plot rather than on the number of vertices; pass lod=False
+    to always draw the full-resolution vertices.
+
+    Series whose X coordinates are sorted (detected automatically, or
+    asserted by passing monotonic=True) only draw the vertices that fall
+    within the plot's current view, located with a binary search, plus one
+    vertex on each side of it so that the lines leaving the view are still
+    drawn.  Pass monotonic=False to disable the detection.
+
+    The data bounds of the series are cached by get_bounds(), which only has
+    to scan the vertices that were appended since it was last called; the
+    bounds are only fully recomputed after existing vertices are overwritten.
+
+    With precision=PRECISION_DOUBLE, each coordinate is stored on the GPU as a
+    float32 hi/lo pair of the raw data value instead of as a single normalized
+    float32.  This doubles the size of the VBO, but the shaders then apply the
+    view transform relative to the center of the view with close to float64
+    precision, so the series never has to be renormalized when the plot pans
+    or zooms.
+
+    With raw=True, the vertices array is uploaded to the GPU directly instead
+    of via a normalized float32 copy, and it is referenced rather than copied
+    by both the Series and its VBO; the array may be memory-mapped.  The
+    shaders then apply the view transform to the raw float32 data coordinates,
+    which is only as precise as float32 data itself, and the series never has
+    to be renormalized.  Since the array belongs to the caller and may be a
+    read-only or file-backed memmap, a raw series never writes into it:
+    set_x_data(), set_y_data() and sub_x_y_data() within the existing
+    vertices raise an Exception.  set_x_y_data() and appends replace the array
+    with a new array of the same dtype, and set_points() attaches a new array
+    without copying it.
+
+    Like everything else that touches GL, the setters must be called from the
+    thread drawing the plot.  Other threads, such as periodic() callbacks,
+    can instead stage new data with push_x_y_data().
     '''
-    MIN_LEN = None
+    MIN_LEN   = None
+    GEOMETRY  = INSTANCE_GEOMETRY
+    BATCHABLE = True
 
     def __init__(self, plot, vertices, color=None, width=1,
-                 point_width=None, visible=True):
+                 point_width=None, visible=True, lod=True,
+                 precision=constants.PRECISION_SINGLE, monotonic=None,
+                 raw=False):
         self.plot        = plot
         self.vertices    = vertices
+        self._storage    = vertices
         self.color       = color
         self.width       = width
         self.point_width = point_width
         self.visible     = visible
+        self.precision   = precision
+        self.monotonic   = monotonic
+        self.raw         = raw
+        self.x_sorted    = False
+        self.batched     = False
+        self._bounds     = (np.inf, np.inf, -np.inf, -np.inf)
+        self._bounds_len = 0
+        self._staged     = []
+        self._stage_lock = threading.Lock()
 
-        self.line_vao = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.line_vao)
+        self.geom_vbo = vbo.StaticVBO(self.GEOMETRY)
+        if raw:
+            if precision == constants.PRECISION_DOUBLE:
+                raise Exception('Raw double-precision vertices not supported')
+            self.vert_vbo = vbo.VBO(vertices, copy=False)
+        elif precision == constants.PRECISION_DOUBLE:
+            self.vert_vbo = vbo.VBO(vbo.split_hi_lo(vertices[:, 0],
+                                                    vertices[:, 1]))
+        else:
+            self.vert_vbo = vbo.VBO(vertices)
+        self.line_vao  = self._gen_line_vao(self.vert_vbo)
+        self.point_vao = self._gen_point_vao(self.vert_vbo)
+        self._update_x_sorted(0, len(vertices))
 
-        self.vert_vbo = vbo.VBO(vertices)
-        self.vert_vbo._attrib_pointer(0)
-        GL.glEnableVertexAttribArray(0)
-        GL.glVertexAttribDivisor(0, 1)
+        self.pyramid = Pyramid(self) if lod else None
+        if self.pyramid:
+            self.pyramid.update(0)
+
+    @staticmethod
+    def _line_attrib_pointers(vert_vbo, first=0):
+        '''
+        Points the per-instance attributes of the currently-bound VAO at the
+        segment joining vertices first and first + 1 of vert_vbo.  Returns the
+        list of attribute units that were set up.
+        '''
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, vert_vbo.vbo)
+        if vert_vbo.ncomponents == 4:
+            vert_vbo._attrib_pointer(0, 16 * first, 2, 16)
+            vert_vbo._attrib_pointer(1, 16 * (first + 1), 2, 16)
+            vert_vbo._attrib_pointer(3, 16 * first + 8, 2, 16)
+            vert_vbo._attrib_pointer(4, 16 * (first + 1) + 8, 2, 16)
+            return (0, 1, 3, 4)
+
+        vert_vbo._attrib_pointer(0, 8 * first)
+        vert_vbo._attrib_pointer(1, 8 * (first + 1))
+        return (0, 1)
+
+    def _gen_line_vao(self, vert_vbo):
+        '''
+        Generates a VAO that draws one line instance between each pair of
+        consecutive vertices in vert_vbo.
+        '''
+        vao = GL.glGenVertexArrays(1)
+        glstate.bind_vertex_array(vao)
 
-        self.vert_vbo._attrib_pointer(1, 8)
-        GL.glEnableVertexAttribArray(1)
-        GL.glVertexAttribDivisor(1, 1)
+        for unit in self._line_attrib_pointers(vert_vbo):
+            GL.glEnableVertexAttribArray(unit)
+            GL.glVertexAttribDivisor(unit, 1)
 
-        self.geom_vbo = vbo.StaticVBO(INSTANCE_GEOMETRY)
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.geom_vbo.vbo)
         self.geom_vbo._attrib_pointer(2)
         GL.glEnableVertexAttribArray(2)
         GL.glVertexAttribDivisor(2, 0)
 
-        self.point_vao = GL.glGenVertexArrays(1)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vert_vbo.vbo)
-        GL.glBindVertexArray(self.point_vao)
-        self.vert_vbo._attrib_pointer(0)
+        glstate.bind_vertex_array(0)
+        return vao
+
+    @staticmethod
+    def _gen_point_vao(vert_vbo):
+        '''
+        Generates a VAO that draws one point for each vertex in vert_vbo.
+        '''
+        vao = GL.glGenVertexArrays(1)
+        glstate.bind_vertex_array(vao)
+
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, vert_vbo.vbo)
+        if vert_vbo.ncomponents == 4:
+            vert_vbo._attrib_pointer(0, 0, 2, 16)
+            vert_vbo._attrib_pointer(1, 8, 2, 16)
+            GL.glEnableVertexAttribArray(1)
+        else:
+            vert_vbo._attrib_pointer(0)
         GL.glEnableVertexAttribArray(0)
 
-        GL.glBindVertexArray(0)
+        glstate.bind_vertex_array(0)
+        return vao
+
+    def _encode_x_y(self, X, Y):
+        '''
+        Returns the X and Y data coordinates encoded as float32 vertices in
+        the series' vertex format.
+        '''
+        if self.precision == constants.PRECISION_DOUBLE:
+            return vbo.split_hi_lo(X, Y)
+
+        V = np.empty((len(X), 2), dtype=np.float32)
+        if self.raw:
+            V[:, 0] = X
+            V[:, 1] = Y
+        else:
+            V[:, 0] = X * self.plot.rmatrix[0][0] + self.plot.rmatrix[0][3]
+            V[:, 1] = Y * self.plot.rmatrix[1][1] + self.plot.rmatrix[1][3]
+        return V
+
+    def _set_vbo_x_y_data(self, vert_vbo, X, Y):
+        '''
+        Replaces all vertices in vert_vbo with the X and Y data coordinates,
+        encoded in the series' vertex format.
+        '''
+        if self.precision == constants.PRECISION_DOUBLE:
+            vert_vbo.set_data(vbo.split_hi_lo(X, Y))
+            return
+
+        if not self.raw:
+            X  = X * self.plot.rmatrix[0][0]
+            X += self.plot.rmatrix[0][3]
+            Y  = Y * self.plot.rmatrix[1][1]
+            Y += self.plot.rmatrix[1][3]
+        vert_vbo.set_x_y_data(X, Y)
+
+    def _sub_vbo_x_y_data(self, vert_vbo, index, X, Y):
+        '''
+        Substitutes the X and Y data coordinates into vert_vbo starting at the
+        specified index, encoded in the series' vertex format.
+        '''
+        if self.precision == constants.PRECISION_DOUBLE:
+            vert_vbo.sub_data(index, vbo.split_hi_lo(X, Y))
+            return
+
+        if not self.raw:
+            X  = X * self.plot.rmatrix[0][0]
+            X += self.plot.rmatrix[0][3]
+            Y  = Y * self.plot.rmatrix[1][1]
+            Y += self.plot.rmatrix[1][3]
+        vert_vbo.sub_x_y_data(index, X, Y)
+
+    def _update_x_sorted(self, index, end):
+        '''
+        Updates the x_sorted flag after the vertices in the range [index, end)
+        were modified.  If the X coordinates were already sorted, only the
+        modified range and its neighbours need to be checked; unsorted
+        coordinates are only rechecked when all of them are replaced.
+        '''
+        if self.monotonic is not None:
+            self.x_sorted = self.monotonic
+            return
+
+        X = self.vertices[:, 0]
+        if index == 0 and end >= len(X):
+            self.x_sorted = bool(np.all(X[1:] >= X[:-1]))
+        elif self.x_sorted:
+            W             = X[max(index - 1, 0):end + 1]
+            self.x_sorted = bool(np.all(W[1:] >= W[:-1]))
+
+    def _invalidate_bounds(self, index=0):
+        '''
+        Notifies the bounds cache that the vertices from the specified index
+        onwards were modified.  Vertices that were only appended just extend
+        the cached bounds, but overwriting vertices that were already covered
+        by them could shrink them so the cache is then reset.
+        '''
+        if index < self._bounds_len:
+            self._bounds     = (np.inf, np.inf, -np.inf, -np.inf)
+            self._bounds_len = 0
+
+    def get_bounds(self):
+        '''
+        Returns the (l, b, r, t) bounds of the series' data, ignoring NaN
+        values.  The bounds are infinite and inverted if there is no data.
+        '''
+        V = self.vertices
+        if self._bounds_len < len(V):
+            T                = V[self._bounds_len:]
+            l, b             = np.fmin.reduce(T, axis=0)
+            r, t             = np.fmax.reduce(T, axis=0)
+            self._bounds     = (np.fmin(self._bounds[0], l),
+                                np.fmin(self._bounds[1], b),
+                                np.fmax(self._bounds[2], r),
+                                np.fmax(self._bounds[3], t))
+            self._bounds_len = len(V)
+        return self._bounds
+
+    def _get_visible_range(self):
+        '''
+        Returns the (first, end) range of vertex indices that must be drawn to
+        cover the plot's current view.  For series with sorted X coordinates
+        this is the range of vertices inside the view plus one on either side;
+        otherwise it is the full range of vertices.
+        '''
+        N = len(self.vertices)
+        if not self.x_sorted or N == 0:
+            return 0, N
+
+        l, r, _, _ = self.plot._get_data_bounds()
+        X          = self.vertices[:, 0]
+        first      = max(int(np.searchsorted(X, l, 'left')) - 1, 0)
+        end        = min(int(np.searchsorted(X, r, 'right')) + 1, N)
+        return first, end
 
     def show(self):
         self.visible = True
+        self.plot.mark_dirty()
 
     def hide(self):
         self.visible = False
+        self.plot.mark_dirty()
 
     def renormalize(self):
         '''
@@ -73,16 +301,25 @@ class Series:
         without any change to the original vertex data.
 
         This performs the normalization math in float64 format and then
-        converts it down to float32 when assigning to the VBO.
+        converts it down to float32 when assigning to the VBO.  Raw series and
+        series with double precision store raw data coordinates and have
+        nothing to do.
         '''
         if len(self.vertices) == 0:
             return
+        if self.raw or self.precision == constants.PRECISION_DOUBLE:
+            return
 
-        X  = self.vertices[:, 0] * self.plot.rmatrix[0][0]
-        X += self.plot.rmatrix[0][3]
-        Y  = self.vertices[:, 1] * self.plot.rmatrix[1][1]
-        Y += self.plot.rmatrix[1][3]
-        self.vert_vbo.set_x_y_data(X, Y)
+        self._set_vbo_x_y_data(self.vert_vbo, self.vertices[:, 0],
+                               self.vertices[:, 1])
+        if self.pyramid:
+            self.pyramid.renormalize()
+
+    def _check_writable(self):
+        if self.raw:
+            raise Exception('Raw series reference the caller\'s array and '
+                            'cannot modify it; replace the vertices with '
+                            'set_x_y_data() or set_points() instead')
 
     def set_x_data(self, X):
         '''
@@ -90,11 +327,20 @@ class Series:
         array and update the VBO data stored on the GPU with the normalized
         vertex data.
         '''
-        X  = np.asarray(X, dtype=np.float64)
-        V  = X * self.plot.rmatrix[0][0]
-        V += self.plot.rmatrix[0][3]
+        self._check_writable()
+        X = np.asarray(X, dtype=np.float64)
         self.vertices[:, 0] = X
-        self.vert_vbo.set_x_data(V)
+        if self.precision == constants.PRECISION_DOUBLE:
+            self._set_vbo_x_y_data(self.vert_vbo, X, self.vertices[:, 1])
+        else:
+            V  = X * self.plot.rmatrix[0][0]
+            V += self.plot.rmatrix[0][3]
+            self.vert_vbo.set_x_data(V)
+        self._update_x_sorted(0, len(X))
+        self._invalidate_bounds()
+        if self.pyramid:
+            self.pyramid.update(0)
+        self.plot.mark_dirty()
 
     def set_y_data(self, Y):
         '''
@@ -102,58 +348,203 @@ class Series:
         array and update the VBO data stored on the GPU with the normalized
         vertex data.
         '''
-        Y  = np.asarray(Y, dtype=np.float64)
-        V  = Y * self.plot.rmatrix[1][1]
-        V += self.plot.rmatrix[1][3]
+        self._check_writable()
+        Y = np.asarray(Y, dtype=np.float64)
         self.vertices[:, 1] = Y
-        self.vert_vbo.set_y_data(V)
+        if self.precision == constants.PRECISION_DOUBLE:
+            self._set_vbo_x_y_data(self.vert_vbo, self.vertices[:, 0], Y)
+        else:
+            V  = Y * self.plot.rmatrix[1][1]
+            V += self.plot.rmatrix[1][3]
+            self.vert_vbo.set_y_data(V)
+        self._invalidate_bounds()
+        if self.pyramid:
+            self.pyramid.update(0)
+        self.plot.mark_dirty()
 
     def set_x_y_data(self, X, Y):
+        assert len(X) == len(Y)
+        if self.raw:
+            V       = np.empty((len(X), 2), dtype=self.vertices.dtype)
+            V[:, 0] = X
+            V[:, 1] = Y
+            self.set_points(V)
+            return
+
         X = np.asarray(X, dtype=np.float64)
         Y = np.asarray(Y, dtype=np.float64)
         self.vertices = np.column_stack((X, Y))
+        self._storage = self.vertices
+        self._update_x_sorted(0, len(X))
+        self._invalidate_bounds()
+        self._set_vbo_x_y_data(self.vert_vbo, X, Y)
+        if self.pyramid:
+            self.pyramid.update(0)
+        self.plot.mark_dirty()
 
-        X  = X * self.plot.rmatrix[0][0]
-        X += self.plot.rmatrix[0][3]
-        Y  = Y * self.plot.rmatrix[1][1]
-        Y += self.plot.rmatrix[1][3]
-        self.vert_vbo.set_x_y_data(X, Y)
+    def set_points(self, points):
+        '''
+        Replaces all the vertices with the (N, 2) points array.  A raw series
+        references a C-contiguous points array directly, which may be an
+        np.memmap, as with add_lines(copy=False); other series copy it.
+        '''
+        if not self.raw:
+            points = np.asarray(points)
+            self.set_x_y_data(points[:, 0], points[:, 1])
+            return
+
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise Exception('set_points requires an (N, 2) points array')
+        self.vertices = np.ascontiguousarray(points)
+        self._storage = self.vertices
+        self._update_x_sorted(0, len(points))
+        self._invalidate_bounds()
+        self.vert_vbo.attach(self.vertices)
+        if self.pyramid:
+            self.pyramid.update(0)
+        self.plot.mark_dirty()
 
     def sub_x_y_data(self, index, X, Y):
         if len(X) == 0:
             return
 
-        X = np.asarray(X, dtype=np.float64)
-        Y = np.asarray(Y, dtype=np.float64)
-        V = np.column_stack((X, Y))
-        overlap_v = V[:len(self.vertices) - index]
-        new_v     = V[len(self.vertices) - index:]
-        if len(overlap_v):
-            self.vertices[-len(overlap_v):] = overlap_v
-        self.vertices = np.concatenate((self.vertices, new_v))
-
-        X  = X * self.plot.rmatrix[0][0]
-        X += self.plot.rmatrix[0][3]
-        Y  = Y * self.plot.rmatrix[1][1]
-        Y += self.plot.rmatrix[1][3]
-        self.vert_vbo.sub_x_y_data(index, X, Y)
+        if index < len(self.vertices):
+            self._check_writable()
+
+        X   = np.asarray(X, dtype=np.float64)
+        Y   = np.asarray(Y, dtype=np.float64)
+        end = index + len(X)
+        n   = max(len(self.vertices), end)
+        self._storage = vbo.reserve(self._storage, len(self.vertices), n)
+        self._storage[index:end, 0] = X
+        self._storage[index:end, 1] = Y
+        self.vertices = self._storage[:n]
+        self._update_x_sorted(index, end)
+        self._invalidate_bounds(index)
+
+        if self.raw:
+            self.vert_vbo.attach(self.vertices, index)
+        else:
+            self._sub_vbo_x_y_data(self.vert_vbo, index, X, Y)
+        if self.pyramid:
+            self.pyramid.update(index)
+        self.plot.mark_dirty()
 
     def append_x_y_data(self, X, Y):
         self.sub_x_y_data(len(self.vertices), X, Y)
 
+    def push_x_y_data(self, X, Y):
+        '''
+        Stages X and Y to be appended to the series at the start of the next
+        frame.  This doesn't touch GL, so unlike append_x_y_data() it can be
+        called from any thread, and all the data pushed during one frame is
+        appended with a single upload.  X and Y are copied.
+        '''
+        X = np.array(X, dtype=np.float64)
+        Y = np.array(Y, dtype=np.float64)
+        assert len(X) == len(Y)
+
+        with self._stage_lock:
+            self._staged.append((X, Y))
+            if len(self._staged) > 1:
+                return
+        self.plot.context._queue_staged(self)
+
+    def _flush_staged(self):
+        '''
+        Appends all the data staged by push_x_y_data().  Called by the context
+        at the start of each frame.
+        '''
+        with self._stage_lock:
+            staged, self._staged = self._staged, []
+        if len(staged) == 1:
+            self.append_x_y_data(*staged[0])
+        elif staged:
+            self.append_x_y_data(np.concatenate([X for X, _ in staged]),
+                                 np.concatenate([Y for _, Y in staged]))
+
+    def _gen_hilo_mvp(self, mvp):
+        '''
+        Returns the (mvp, origin) pair used to draw split-precision vertices.
+        The origin is the center of the plot's current view in data
+        coordinates, as a float32 (hi, lo) pair, and the returned matrix maps
+        data coordinates relative to it so that the shaders only ever have to
+        deal with small offsets from the view.
+        '''
+        l, r, b, t = self.plot._get_data_bounds()
+        o          = np.array(((l + r) / 2, (b + t) / 2), dtype=np.float64)
+        hi         = o.astype(np.float32)
+        lo         = (o - hi).astype(np.float32)
+        mvp        = (mvp @ self.plot.rmatrix @
+                      matrix.translate(o[0], o[1], dtype=np.float64))
+        return mvp, (hi, lo)
+
+    def _get_programs(self, mvp):
+        '''
+        Returns the (line program, point program, mvp, kwargs) tuple used to
+        draw the series' vertex format, where kwargs holds the extra uniform
+        arguments for the programs' use() methods.
+        '''
+        if self.raw:
+            return (programs.square_line, programs.frag_points,
+                    mvp @ self.plot.rmatrix, {})
+        if self.precision == constants.PRECISION_DOUBLE:
+            mvp, origin = self._gen_hilo_mvp(mvp)
+            return (programs.square_line_hilo, programs.frag_points_hilo, mvp,
+                    {'origin' : origin})
+        return programs.square_line, programs.frag_points, mvp, {}
+
+    def _draw_line_instances(self, vao, vert_vbo, first, ninstances):
+        '''
+        Draws ninstances line instances from vao, starting with the segment
+        joining vertices first and first + 1 of vert_vbo.  GL 3.3 has no
+        base-instance draw call, so the per-instance attribute pointers of the
+        VAO are offset instead.
+        '''
+        glstate.bind_vertex_array(vao)
+        self._line_attrib_pointers(vert_vbo, first)
+        gldispatch.glDrawArraysInstanced(GL.GL_TRIANGLES, 0,
+                                         len(self.GEOMETRY), ninstances)
+
+    def _get_line_range(self, first, end):
+        '''
+        Given the (first, end) range of source vertices to draw, returns a
+        (vao, vert_vbo, first, end) tuple selecting the vertices from which
+        the lines should actually be drawn, which come from a level of the LOD
+        pyramid if the series is dense enough at the current zoom.
+        '''
+        level = None
+        if self.pyramid:
+            level = self.pyramid.select(end - first if self.x_sorted else None)
+        if level is None:
+            return self.line_vao, self.vert_vbo, first, end
+
+        first, end = level.vertex_range(first, end)
+        return level.line_vao, level.vert_vbo, first, end
+
+    def _draw_lines(self, z, mvp, resolution, first, end):
+        '''
+        Draws the lines joining the source vertices in the (first, end) range,
+        from the vertices selected by _get_line_range().
+        '''
+        line_program, _, mvp, kwargs = self._get_programs(mvp)
+        vao, vert_vbo, first, end    = self._get_line_range(first, end)
+        if end - first >= 2:
+            line_program.use(self.width, z, mvp, color=self.color,
+                             resolution=resolution, **kwargs)
+            self._draw_line_instances(vao, vert_vbo, first, end - first - 1)
+
     def draw(self, _t, z, mvp, resolution):
         if not self.visible:
             return
 
-        if self.width and len(self.vert_vbo) >= 2:
-            GL.glBindVertexArray(self.line_vao)
-            programs.square_line.use(self.width, z, mvp, color=self.color,
-                                     resolution=resolution)
-            GL.glDrawArraysInstanced(GL.GL_TRIANGLES, 0, len(INSTANCE_GEOMETRY),
-                                     len(self.vert_vbo) - 1)
-
-        if self.point_width and len(self.vert_vbo) >= 1:
-            GL.glBindVertexArray(self.point_vao)
-            programs.frag_points.use(z, mvp, color=self.color)
-            GL.glPointSize(self.point_width * self.plot.context.r_w)
-            GL.glDrawArrays(GL.GL_POINTS, 0, len(self.vert_vbo))
+        first, end = self._get_visible_range()
+        if self.width and not self.batched and len(self.vert_vbo) >= 2:
+            self._draw_lines(z, mvp, resolution, first, end)
+
+        if self.point_width and end > first:
+            _, point_program, mvp, kwargs = self._get_programs(mvp)
+            glstate.bind_vertex_array(self.point_vao)
+            point_program.use(z, mvp, color=self.color, **kwargs)
+            gldispatch.glPointSize(self.point_width * self.plot.context.r_w)
+            gldispatch.glDrawArrays(GL.GL_POINTS, first, end - first)
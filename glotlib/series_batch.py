@@ -0,0 +1,254 @@
+from ctypes import c_void_p
+
+import numpy as np
+from OpenGL import GL
+
+from . import vbo
+from . import constants
+from . import programs
+from . import glstate
+from . import gldispatch
+from .series import INSTANCE_GEOMETRY
+
+
+class BatchVBO(vbo.VBO):
+    '''
+    The vertices of one batched series, stored in a region of the packed
+    vertex buffer shared by the whole SeriesBatch instead of in a buffer of
+    their own.  The region starts at vertex index base and holds capacity
+    vertices, of which the first nfilled have been uploaded and tagged with
+    the series' slot in the batch's slot buffer; the rest are tagged -1.
+    When the series outgrows its region the batch repacks all the regions
+    into a larger buffer.
+    '''
+    def __init__(self, batch, slot):
+        # pylint: disable=super-init-not-called
+        self.batch       = batch
+        self.slot        = slot
+        self.vertices    = np.zeros((0, 2), dtype=np.float32)
+        self._storage    = self.vertices
+        self.ncomponents = 2
+        self.gl_type     = GL.GL_DYNAMIC_DRAW
+        self.capacity    = 0
+        self.version     = 0
+        self.base        = 0
+        self.nfilled     = 0
+
+    @property
+    def vbo(self):
+        return self.batch.vert_buf
+
+    def _attrib_pointer(self, unit, offset=0, size=None, stride=0):
+        super()._attrib_pointer(unit, offset + 8 * self.base, size, stride)
+
+    def _sub_vbo(self, first, N):
+        '''
+        Writes N values of self.vertices starting at index first to the
+        region, growing it if necessary, and retags the vertices that were
+        added to or removed from the end of the series.
+        '''
+        if self.capacity < len(self.vertices):
+            self.batch._repack(self, vbo.ceil_pow2(len(self.vertices)))
+            first = 0
+            N     = len(self.vertices)
+        self._sub_vbo_range(first, N)
+
+        n = len(self.vertices)
+        if n != self.nfilled:
+            i0, i1 = sorted((self.nfilled, n))
+            slots  = np.full(i1 - i0, self.slot if n > i0 else -1,
+                             dtype=np.int32)
+            gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.batch.slot_buf)
+            gldispatch.glBufferSubData(GL.GL_ARRAY_BUFFER,
+                                       4 * (self.base + i0), slots.nbytes,
+                                       slots)
+            self.nfilled = n
+
+    def _sub_vbo_range(self, first, N):
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        for i in range(first, first + N, vbo.UPLOAD_CHUNK_LEN):
+            n = min(first + N - i, vbo.UPLOAD_CHUNK_LEN)
+            V = np.ascontiguousarray(self.vertices[i:i + n],
+                                     dtype=np.float32)
+            gldispatch.glBufferSubData(GL.GL_ARRAY_BUFFER,
+                                       8 * (self.base + i), V.nbytes, V)
+        self.version += 1
+
+
+class SeriesBatch:
+    '''
+    Draws the lines of up to BatchLineProgram.MAX_SERIES series of a plot
+    with one program binding and one instanced draw call.  The vertices of
+    the batched series are packed into a single vertex buffer, each series in
+    a region that it appends into (see BatchVBO), alongside a buffer tagging
+    every vertex with the slot of its series.  One instance is drawn per
+    vertex of the packed buffer, and the shader drops the instances that
+    don't join two vertices of the same series; the width and color of each
+    series are held in uniform arrays indexed by slot, which the program's
+    uniform cache only uploads again when a series is restyled.
+
+    Only plain, non-raw single-precision Series can be batched (see
+    Series.BATCHABLE).  Batched series are drawn in full rather than just
+    over the plot's current view, but a series that is dense enough to be
+    drawn from one of its LOD levels is drawn on its own, as are its points.
+    The plot draws each run of consecutive batched series at its place among
+    the plot's graph artists, so batching doesn't change the z-order.
+    '''
+    def __init__(self, plot):
+        self.plot     = plot
+        self.series   = []
+        self.vbos     = []
+        self.capacity = 0
+        self.vert_buf = GL.glGenBuffers(1)
+        self.slot_buf = GL.glGenBuffers(1)
+        self.vao      = GL.glGenVertexArrays(1)
+        self.vao_base = None
+
+        glstate.bind_vertex_array(self.vao)
+        for unit in (0, 1, 5, 6):
+            GL.glEnableVertexAttribArray(unit)
+            GL.glVertexAttribDivisor(unit, 1)
+
+        self.geom_vbo = vbo.StaticVBO(INSTANCE_GEOMETRY)
+        self.geom_vbo._attrib_pointer(2)
+        GL.glEnableVertexAttribArray(2)
+        GL.glVertexAttribDivisor(2, 0)
+
+        glstate.bind_vertex_array(0)
+
+    def accepts(self, s):
+        return (s.BATCHABLE and not s.raw and
+                s.precision == constants.PRECISION_SINGLE and
+                len(self.series) < programs.BatchLineProgram.MAX_SERIES)
+
+    def add(self, s):
+        '''
+        Moves the vertices of the series into the packed buffer.
+        '''
+        assert self.accepts(s)
+        v      = BatchVBO(self, len(self.vbos))
+        v.base = self.capacity
+        self.series.append(s)
+        self.vbos.append(v)
+        v.set_data(s.vert_vbo.vertices)
+
+        GL.glDeleteBuffers(1, [s.vert_vbo.vbo])
+        GL.glDeleteVertexArrays(2, [s.line_vao, s.point_vao])
+        s.vert_vbo  = v
+        s.line_vao  = s._gen_line_vao(v)
+        s.point_vao = s._gen_point_vao(v)
+        s.batched   = True
+
+    def _repack(self, grown, capacity):
+        '''
+        Reallocates the packed buffers with the region of the grown BatchVBO
+        enlarged to capacity vertices, copying the vertices of the other
+        regions over on the GPU.  The regions are laid out in slot order, so
+        that the single draw call draws the series in order.  The contents of
+        the grown region are left for the caller to upload.
+        '''
+        caps = [capacity if v is grown else v.capacity for v in self.vbos]
+        self.capacity = sum(caps)
+
+        vert_buf = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, vert_buf)
+        GL.glBufferData(GL.GL_COPY_WRITE_BUFFER, 8 * self.capacity, None,
+                        GL.GL_DYNAMIC_DRAW)
+        GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, self.vert_buf)
+
+        slots = np.full(self.capacity, -1, dtype=np.int32)
+        base  = 0
+        for v, cap in zip(self.vbos, caps):
+            if v is grown:
+                v.nfilled = 0
+            elif v.nfilled:
+                GL.glCopyBufferSubData(GL.GL_COPY_READ_BUFFER,
+                                       GL.GL_COPY_WRITE_BUFFER, 8 * v.base,
+                                       8 * base, 8 * v.nfilled)
+                slots[base:base + v.nfilled] = v.slot
+            v.base     = base
+            v.capacity = cap
+            base      += cap
+
+        GL.glDeleteBuffers(1, [self.vert_buf])
+        self.vert_buf = vert_buf
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.slot_buf)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, slots.nbytes, slots,
+                        GL.GL_DYNAMIC_DRAW)
+        self.vao_base = None
+
+        # The point VAOs of the series still point at the old buffer.
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, vert_buf)
+        for s, v in zip(self.series, self.vbos):
+            if s.vert_vbo is v:
+                glstate.bind_vertex_array(s.point_vao)
+                v._attrib_pointer(0)
+        glstate.bind_vertex_array(0)
+
+    def _attrib_pointers(self, base):
+        '''
+        Points the per-instance attributes of the batch VAO at the segment
+        joining packed vertices base and base + 1.
+        '''
+        if base == self.vao_base:
+            return
+
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vert_buf)
+        for unit, i in ((0, base), (1, base + 1)):
+            gldispatch.glVertexAttribPointer(unit, 2, GL.GL_FLOAT,
+                                             GL.GL_FALSE, 0, c_void_p(8 * i))
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.slot_buf)
+        for unit, i in ((5, base), (6, base + 1)):
+            gldispatch.glVertexAttribIPointer(unit, 1, GL.GL_INT, 0,
+                                              c_void_p(4 * i))
+        self.vao_base = base
+
+    def _draw_packed(self, run, z, mvp, resolution):
+        '''
+        Draws the lines of a run of series with consecutive slots with a
+        single draw call.
+        '''
+        first = run[0].vert_vbo
+        last  = run[-1].vert_vbo
+        n     = last.base + last.nfilled - first.base - 1
+        if n < 1:
+            return
+
+        program = programs.batch_line
+        program.use(z, mvp, resolution)
+        program.set_series(
+            [s.width if s.visible else 0 for s in self.series],
+            [s.color for s in self.series])
+        glstate.bind_vertex_array(self.vao)
+        self._attrib_pointers(first.base)
+        gldispatch.glDrawArraysInstanced(GL.GL_TRIANGLES, 0,
+                                         len(INSTANCE_GEOMETRY), n)
+
+    def draw(self, series, _t, z, mvp, resolution):
+        '''
+        Draws the lines of the specified batched series, in order.  Runs of
+        series with consecutive slots are drawn together; series drawn from an
+        LOD level are drawn on their own.
+        '''
+        run = []
+        for s in series:
+            # Series with no lines to draw are masked out by the shader, so
+            # they can stay in the run.
+            packed = not s.visible or not s.width or len(s.vert_vbo) < 2
+            if not packed:
+                first, end        = s._get_visible_range()
+                _, vert_vbo, _, _ = s._get_line_range(first, end)
+                packed            = vert_vbo is s.vert_vbo
+            if packed:
+                if run and run[-1].vert_vbo.slot + 1 != s.vert_vbo.slot:
+                    self._draw_packed(run, z, mvp, resolution)
+                    run = []
+                run.append(s)
+                continue
+
+            if run:
+                self._draw_packed(run, z, mvp, resolution)
+                run = []
+            s._draw_lines(z, mvp, resolution, first, end)
+        if run:
+            self._draw_packed(run, z, mvp, resolution)
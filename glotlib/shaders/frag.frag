@@ -2,9 +2,17 @@
 
 uniform vec4 u_color;
 
+#ifdef BATCH
+flat in vec4 v_color;
+#endif
+
 out vec4 fragColor;
 
 void main()
 {
+#ifdef BATCH
+    fragColor = v_color;
+#else
     fragColor = u_color;
+#endif
 }
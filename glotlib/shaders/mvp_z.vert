@@ -4,7 +4,19 @@ layout (location = 0) in vec2 a_vertex;
 uniform mat4  u_mvp;
 uniform float u_z;
 
+#ifdef HILO
+// Split-precision vertices; see square_instanced_line.vert.
+layout (location = 1) in vec2 a_vertex_lo;
+uniform vec2 u_origin_hi;
+uniform vec2 u_origin_lo;
+#endif
+
 void main()
 {
+#ifdef HILO
+    vec2 v = (a_vertex - u_origin_hi) + (a_vertex_lo - u_origin_lo);
+    gl_Position = u_mvp * vec4(v, u_z, 1);
+#else
     gl_Position = u_mvp * vec4(a_vertex, u_z, 1);
+#endif
 }
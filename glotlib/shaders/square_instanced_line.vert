@@ -9,12 +9,74 @@ uniform vec2 u_resolution;
 uniform float u_width;
 uniform float u_z;
 
+#ifdef BATCH
+// The vertices of a whole batch of series are packed into one buffer, along
+// with the slot of the series each vertex belongs to, or -1 for unused
+// vertices.  A segment only joins two vertices of the same series, and the
+// width and color of each series come from its slot of the uniform arrays.
+layout (location = 5) in int a_slot0;
+layout (location = 6) in int a_slot1;
+uniform float u_widths[MAX_SERIES];
+uniform vec4  u_colors[MAX_SERIES];
+flat out vec4 v_color;
+#endif
+
+#ifdef HILO
+// Each data coordinate is split into a float32 hi part and the float32 lo
+// remainder.  Subtracting the view origin from each part separately before
+// adding them recovers the position relative to the origin with far more
+// precision than a single float32 could hold, so u_mvp can map data
+// coordinates near the view directly without any renormalization of the
+// vertex data.
+layout (location = 3) in vec2 a_p0_lo;
+layout (location = 4) in vec2 a_p1_lo;
+uniform vec2 u_origin_hi;
+uniform vec2 u_origin_lo;
+
+vec2 relative(vec2 hi, vec2 lo)
+{
+    return (hi - u_origin_hi) + (lo - u_origin_lo);
+}
+#endif
+
 void main()
 {
+#ifdef BATCH
+    if (a_slot0 < 0 || a_slot0 != a_slot1) {
+        // Not a segment: place the instance outside the clip volume.
+        v_color     = vec4(0);
+        gl_Position = vec4(0, 0, 2, 1);
+        return;
+    }
+    float width = u_widths[a_slot0];
+    v_color     = u_colors[a_slot0];
+#else
+    float width = u_width;
+#endif
+
     // Convert from geometry coordinates to clip coordinates == NDC since this
     // is an orthographic projection.
+#ifdef HILO
+    vec2 p0 = (u_mvp * vec4(relative(a_p0, a_p0_lo), 0, 1)).xy;
+    vec2 p1 = (u_mvp * vec4(relative(a_p1, a_p1_lo), 0, 1)).xy;
+#else
     vec2 p0 = (u_mvp * vec4(a_p0, 0, 1)).xy;
     vec2 p1 = (u_mvp * vec4(a_p1, 0, 1)).xy;
+#endif
+
+#ifdef STEP
+    // Each instance draws a step from p0 to p1: the vertical segment from p0
+    // to the corner (p0.x, p1.y) followed by the horizontal segment from the
+    // corner to p1.  The first six vertices of the instance geometry belong
+    // to the vertical segment and the last six to the horizontal one.  This
+    // is an orthographic projection, so the corner can be computed directly
+    // in clip coordinates.
+    vec2 corner = vec2(p0.x, p1.y);
+    if (gl_VertexID < 6)
+        p1 = corner;
+    else
+        p0 = corner;
+#endif
 
     // Get a normal vector of the appropriate length for the screen resolution.
     // The constant K converts NDC coordinates to screen coordinates - the 0.5
@@ -25,7 +87,7 @@ void main()
     vec2 v_K     = 0.5 * u_resolution;
     vec2 v_line  = (p1 - p0) * v_K;
     vec2 nv_line = normalize(vec2(-v_line.y, v_line.x));
-    vec2 nv      = nv_line * u_width * a_vertex.y / v_K;
+    vec2 nv      = nv_line * width * a_vertex.y / v_K;
 
     // The origin point for this vertex is either p0 or p1 depending on if we
     // are on the "left" or "right" side of the geometry, which is encoded in
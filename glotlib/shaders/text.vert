@@ -5,11 +5,12 @@ layout (location = 1) in vec2 a_texcoord;
 
 uniform mat4  u_mvp;
 uniform float u_z;
+uniform vec2  u_tex_scale;
 
 out vec2 texcoord;
 
 void main()
 {
     gl_Position = u_mvp * vec4(a_vertex, u_z, 1);
-    texcoord = a_texcoord;
+    texcoord = a_texcoord * u_tex_scale;
 }
@@ -0,0 +1,11 @@
+#version 330
+
+uniform sampler2D u_sampler;
+
+in vec2 texcoord;
+out vec4 fragColor;
+
+void main()
+{
+    fragColor = texture(u_sampler, texcoord);
+}
@@ -0,0 +1,64 @@
+import numpy as np
+from OpenGL import GL
+
+from . import vbo
+from . import programs
+from . import glstate
+from . import gldispatch
+
+
+class TextBatch:
+    '''
+    Draws a set of Labels sharing the same font with a single draw call.  The
+    glyph quads of all visible Labels are packed into one buffer with each
+    Label's transform already applied, so the batch is drawn in context
+    coordinates.  The buffer is only rebuilt when a Label's text, placement
+    or visibility changes, which is detected through the Label version
+    fields.
+    '''
+    def __init__(self, font, labels):
+        assert all(l.font is font for l in labels)
+
+        self.font      = font
+        self.labels    = labels
+        self.key       = None
+        self.nvertices = 0
+
+        self.vao = GL.glGenVertexArrays(1)
+        glstate.bind_vertex_array(self.vao)
+        self.geom_vbo = vbo.VBO(np.empty((0, 2)))
+        self.geom_vbo._attrib_pointer(0)
+        GL.glEnableVertexAttribArray(0)
+        self.tex_vbo = vbo.VBO(np.empty((0, 2)))
+        self.tex_vbo._attrib_pointer(1)
+        GL.glEnableVertexAttribArray(1)
+        glstate.bind_vertex_array(0)
+
+    def _rebuild(self):
+        labels = [l for l in self.labels if l.visible and l.nvertices]
+        if labels:
+            vertices   = np.concatenate([l.get_transformed_vertices()
+                                         for l in labels])
+            tex_coords = np.concatenate([l.tex_coords for l in labels])
+        else:
+            vertices   = np.empty((0, 2))
+            tex_coords = np.empty((0, 2))
+
+        self.geom_vbo.set_data(vertices)
+        self.tex_vbo.set_data(tex_coords)
+        self.nvertices = len(vertices)
+
+    def draw(self, mvp, color=(0, 0, 0, 1)):
+        key = tuple((l.version, l.visible) for l in self.labels)
+        if key != self.key:
+            self._rebuild()
+            self.key = key
+        if not self.nvertices:
+            return
+
+        self.font.bind(0)
+        programs.text.use(0, mvp, self.font, color=color)
+        gldispatch.glEnable(GL.GL_BLEND)
+        glstate.bind_vertex_array(self.vao)
+        gldispatch.glDrawArrays(GL.GL_TRIANGLES, 0, self.nvertices)
+        gldispatch.glDisable(GL.GL_BLEND)
@@ -1,9 +1,22 @@
+import collections
 import math
 
+import numpy as np
+
 
 R    = (1., 2., 5.)
 DLOG = (0, 0, 0, 1)
 
+# Number of (dx, tick index range) tick sets and of tick spacings whose
+# formatted texts are remembered, and the number of texts remembered per
+# spacing.
+TICKS_CACHE_SIZE  = 64
+TEXTS_CACHE_SIZE  = 16
+TEXTS_PER_SPACING = 1024
+
+_ticks_cache = collections.OrderedDict()
+_texts_cache = collections.OrderedDict()
+
 
 def gen_ticks_dx(w, Nmin, Nmax):
     w_log        = math.log(w, 10)
@@ -25,6 +38,43 @@ def gen_ticks_dx(w, Nmin, Nmax):
     return best, -best_K
 
 
+def _gen_tick_indices(l, r, Nmin, Nmax):
+    '''
+    Returns the (dx, K, i_min, i_max) tuple such that the ticks between l and
+    r are i * dx for i_min <= i <= i_max, with K as for gen_ticks().  The
+    divisions can round the bounds off by one, so they are nudged by one
+    where needed; that is exact as long as the indices are exactly
+    representable as floats, and ranges too narrow for that are left to
+    _gen_tick_values() to clean up.
+    '''
+    dx, K = gen_ticks_dx(r - l, Nmin, Nmax)
+    i_min = math.ceil(l / dx)
+    i_max = math.floor(r / dx)
+    if i_min * dx < l:
+        i_min += 1
+    elif (i_min - 1) * dx >= l:
+        i_min -= 1
+    if i_max * dx > r:
+        i_max -= 1
+    elif (i_max + 1) * dx <= r:
+        i_max += 1
+    return dx, K, i_min, i_max
+
+
+def _gen_tick_values(dx, i_min, i_max):
+    '''
+    Returns the (I, ticks) pair of lists of the tick indices between i_min
+    and i_max and of their coordinates i * dx.  When the range is too narrow
+    for the float precision of its coordinates, consecutive indices can map
+    to the same coordinate, and only the first index of each is kept.
+    '''
+    I        = np.arange(i_min, i_max + 1)
+    T        = I * dx
+    keep     = np.ones(len(T), dtype=bool)
+    keep[1:] = T[1:] != T[:-1]
+    return I[keep].tolist(), T[keep].tolist()
+
+
 def gen_ticks(l, r, Nmin=2, Nmax=5):
     '''
     Generates a list of numbers that should be used as tick coordinates.
@@ -39,10 +89,8 @@ def gen_ticks(l, r, Nmin=2, Nmax=5):
     if w == 0:
         a, K = [l], 10
     else:
-        dx, K = gen_ticks_dx(r - l, Nmin, Nmax)
-        i_min = math.floor(l / dx)
-        i_max = math.ceil(r / dx)
-        a = [i * dx for i in range(i_min, i_max + 1) if l <= i * dx <= r]
+        dx, K, i_min, i_max = _gen_tick_indices(l, r, Nmin, Nmax)
+        _, a = _gen_tick_values(dx, i_min, i_max)
 
     # print('(%.10f, %.10f): %u %s' % (l, r, K, a))
     return a, K
@@ -60,14 +108,73 @@ def _text_for_val(v, K):
     return text
 
 
-def gen_ticks_and_texts(*args, **kwargs):
+def _texts_for_vals(V, K):
+    '''
+    Vectorized _text_for_val() over the array V, returning a list of strings.
+    Values are formatted together in groups sharing the same precision.
+    '''
+    V      = np.asarray(V, dtype=np.float64)
+    texts  = np.full(len(V), '0', dtype=object)
+    nz     = (V != 0)
+    digits = np.zeros(len(V), dtype=np.int64)
+    digits[nz] = (np.floor(np.log10(np.abs(V[nz]))).astype(np.int64) +
+                  max(K, 0) + 1)
+    for d in np.unique(digits[nz]):
+        sel        = nz & (digits == d)
+        texts[sel] = np.char.rstrip(np.char.mod('%%#.%ug' % max(d, 0),
+                                                V[sel]), '.')
+    return [str(t) for t in texts]
+
+
+def _gen_texts(dx, K, I):
+    '''
+    Returns the texts of the ticks i * dx for i in I, formatting only those
+    that aren't already remembered for this spacing.
+    '''
+    key   = (dx, K)
+    known = _texts_cache.get(key)
+    if known is None:
+        known = _texts_cache[key] = {}
+        if len(_texts_cache) > TEXTS_CACHE_SIZE:
+            _texts_cache.popitem(last=False)
+    else:
+        _texts_cache.move_to_end(key)
+
+    missing = [i for i in I if i not in known]
+    if missing:
+        if len(known) + len(missing) > TEXTS_PER_SPACING:
+            known.clear()
+            missing = list(I)
+        V = np.array(missing, dtype=np.int64) * dx
+        known.update(zip(missing, _texts_for_vals(V, K)))
+    return [known[i] for i in I]
+
+
+def gen_ticks_and_texts(l, r, Nmin=2, Nmax=5):
     '''
     Generates a pair of lists that include the tick coordinates as numbers and
     as formatted text for display.
+
+    Results are memoized by tick spacing and index range, which are computed
+    without visiting the individual ticks, so redrawing the same range is a
+    lookup, and the formatted texts are remembered per spacing, so panning
+    without zooming only formats the ticks that scroll into view.
     '''
-    ticks, K = gen_ticks(*args, **kwargs)
-    texts    = [_text_for_val(t, K) for t in ticks]
-    return ticks, texts
+    if l == r:
+        ticks, K = gen_ticks(l, r, Nmin, Nmax)
+        return ticks, [_text_for_val(t, K) for t in ticks]
+
+    key    = _gen_tick_indices(l, r, Nmin, Nmax)
+    result = _ticks_cache.get(key)
+    if result is None:
+        dx, K, i_min, i_max = key
+        I, ticks = _gen_tick_values(dx, i_min, i_max)
+        result   = _ticks_cache[key] = (ticks, _gen_texts(dx, K, I))
+        if len(_ticks_cache) > TICKS_CACHE_SIZE:
+            _ticks_cache.popitem(last=False)
+    else:
+        _ticks_cache.move_to_end(key)
+    return list(result[0]), list(result[1])
 
 
 assert _text_for_val(32700, -2) == '32700'
@@ -78,3 +185,6 @@ assert _text_for_val(1000, -2) == '1000'
 assert _text_for_val(0.0001, 5) == '0.00010'
 assert _text_for_val(0.00001, 6) == '1.0e-05'
 assert _text_for_val(0.00001, 7) == '1.00e-05'
+assert _texts_for_vals([0, 32700, -1000, 0.5], 1) == ['0', '32700.0',
+                                                      '-1000.0', '0.5']
+assert _texts_for_vals([0.0001, 0.00001], 6) == ['0.000100', '1.0e-05']
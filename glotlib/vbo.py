@@ -4,11 +4,49 @@ from ctypes import c_void_p
 import numpy as np
 from OpenGL import GL
 
+from . import gldispatch
+
+
+# Uploads are split into chunks of at most this many vertices, so that
+# vertices that are not already float32 only ever need a chunk-sized
+# temporary float32 copy and memory-mapped vertices are paged in gradually.
+UPLOAD_CHUNK_LEN = 1 << 20
+
 
 def ceil_pow2(v):
     return (1 << math.ceil(math.log2(v)))
 
 
+def reserve(storage, nkeep, n):
+    '''
+    Returns a backing array with room for at least n rows that holds the first
+    nkeep rows of storage.  If storage is already large enough it is returned
+    as-is; otherwise a new array is allocated with its row count rounded up to
+    a power of 2, so that a sequence of appends costs amortized O(1) per row.
+    '''
+    if len(storage) >= n:
+        return storage
+
+    new         = np.empty((ceil_pow2(n),) + storage.shape[1:],
+                           dtype=storage.dtype)
+    new[:nkeep] = storage[:nkeep]
+    return new
+
+
+def split_hi_lo(X, Y):
+    '''
+    Splits the float64 X and Y coordinates into float32 (hi, lo) pairs, where
+    hi is the nearest float32 to the value and lo is the float32 nearest to
+    the remainder.  Returns an array of (x_hi, y_hi, x_lo, y_lo) vertices.
+    '''
+    V       = np.empty((len(X), 4), dtype=np.float32)
+    V[:, 0] = X
+    V[:, 1] = Y
+    V[:, 2] = X - V[:, 0]
+    V[:, 3] = Y - V[:, 1]
+    return V
+
+
 class VBO:
     '''
     This class holds a set of vertices in float32 format, bound to a hardware
@@ -16,23 +54,39 @@ class VBO:
     field in the VBO stores renormalized data while the Series object contains
     the original data.  The VBO remains bound to GL_ARRAY_BUFFER after
     initialization.
+
+    The vertices field is a view of the filled prefix of a larger backing
+    array that grows by doubling, so that appending to the VBO doesn't have to
+    copy all of the existing vertices each time.
+
+    The version field is incremented whenever data is uploaded to the VBO so
+    that anything deriving data from the buffer can tell when it changed.
+
+    With copy=False, the vertices array is attached to the VBO as-is instead
+    of being copied into float32 storage (see attach()).
     '''
     def __init__(self, vertices=None, ncomponents=None,
-                 gl_type=GL.GL_DYNAMIC_DRAW):
+                 gl_type=GL.GL_DYNAMIC_DRAW, copy=True):
         self.vertices = None
+        self._storage = None
         self.gl_type  = gl_type
         self.vbo      = GL.glGenBuffers(1)
         self.capacity = 0
+        self.version  = 0
 
-        if vertices is not None and ncomponents:
+        if not copy:
+            self.ncomponents = vertices.shape[1]
+            self.attach(vertices)
+        elif vertices is not None and ncomponents:
             assert len(vertices[0]) == ncomponents
             self.ncomponents = ncomponents
             self.set_data(vertices)
         elif ncomponents:
             self.ncomponents = ncomponents
-            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+            gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
         elif len(vertices) == 0:
-            self.ncomponents = 2
+            self.ncomponents = (vertices.shape[1] if np.ndim(vertices) == 2
+                                else 2)
             self.set_data(vertices)
         else:
             self.ncomponents = len(vertices[0])
@@ -41,12 +95,12 @@ class VBO:
     def __len__(self):
         return len(self.vertices)
 
-    def _sub_vbo_tail(self, N):
+    def _sub_vbo(self, first, N):
         '''
-        Writes the last N values of self.vertices to the VBO, enlarging the
-        VBO buffer if necessary.
+        Writes N values of self.vertices starting at index first to the VBO,
+        enlarging the VBO buffer if necessary.
         '''
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
 
         # Enlarge the VBO and copy it all in if necessary.
         if self.capacity < len(self.vertices):
@@ -54,19 +108,41 @@ class VBO:
             GL.glBufferData(GL.GL_ARRAY_BUFFER,
                             4 * self.ncomponents * self.capacity,
                             None, self.gl_type)
-            N = len(self.vertices)
+            first = 0
+            N     = len(self.vertices)
 
         # Sub in the new data.
-        offset = 4 * self.ncomponents * (len(self.vertices) - N)
-        size   = 4 * self.ncomponents * N
-        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, offset, size, self.vertices[-N:])
+        self._sub_vbo_range(first, N)
+
+    def _sub_vbo_tail(self, N):
+        '''
+        Writes the last N values of self.vertices to the VBO, enlarging the
+        VBO buffer if necessary.
+        '''
+        self._sub_vbo(len(self.vertices) - N, N)
+
+    def _sub_vbo_range(self, first, N):
+        '''
+        Writes N values of self.vertices starting at index first to the VBO,
+        which must already be large enough to hold them.
+        '''
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        for i in range(first, first + N, UPLOAD_CHUNK_LEN):
+            n      = min(first + N - i, UPLOAD_CHUNK_LEN)
+            offset = 4 * self.ncomponents * i
+            size   = 4 * self.ncomponents * n
+            gldispatch.glBufferSubData(
+                GL.GL_ARRAY_BUFFER, offset, size,
+                np.ascontiguousarray(self.vertices[i:i + n], dtype=np.float32))
+        self.version += 1
 
     def _update_vbo(self):
         self._sub_vbo_tail(len(self.vertices))
 
-    def _attrib_pointer(self, unit, offset=0):
-        GL.glVertexAttribPointer(unit, self.ncomponents, GL.GL_FLOAT,
-                                 GL.GL_FALSE, 0, c_void_p(offset))
+    def _attrib_pointer(self, unit, offset=0, size=None, stride=0):
+        gldispatch.glVertexAttribPointer(unit, size or self.ncomponents,
+                                         GL.GL_FLOAT, GL.GL_FALSE, stride,
+                                         c_void_p(offset))
 
     def set_data(self, vertices):
         '''
@@ -77,9 +153,59 @@ class VBO:
         if len(vertices):
             assert self.ncomponents == vertices.shape[1]
 
+        self._storage = vertices
         self.vertices = vertices
         self._update_vbo()
 
+    def orphan(self):
+        '''
+        Detaches the buffer's current storage and allocates fresh storage of
+        the same size, so that the next upload doesn't have to wait for any
+        pending draws that still read from the old storage; the driver frees
+        it once they complete.  The buffer contents are undefined until the
+        next upload, which should replace all of them.
+        '''
+        if not self.capacity:
+            return
+
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER,
+                        4 * self.ncomponents * self.capacity,
+                        None, self.gl_type)
+
+    def attach(self, vertices, index=0):
+        '''
+        Makes the VBO reference the specified array of vertices directly
+        instead of a float32 copy of them, and uploads the vertices starting
+        at index, which must be the first vertex that differs from what was
+        uploaded previously.  The array can be any C-contiguous array of
+        vertices, including a memory-mapped one; vertices that are not float32
+        are converted one chunk at a time as they are uploaded.
+
+        When attaching a new array from index 0, the buffer is sized to fit it
+        exactly rather than rounded up to a power of 2.
+        '''
+        assert self.ncomponents == vertices.shape[1]
+        if index == 0 and self.capacity < len(vertices):
+            gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+            self.capacity = len(vertices)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER,
+                            4 * self.ncomponents * self.capacity,
+                            None, self.gl_type)
+
+        self._storage = vertices
+        self.vertices = vertices
+        self._sub_vbo(index, len(vertices) - index)
+
+    def _resize(self, n):
+        '''
+        Resizes the vertices list to n entries, preserving the existing
+        entries that still fit.  New entries are uninitialized.
+        '''
+        nkeep         = min(n, len(self.vertices))
+        self._storage = reserve(self._storage, nkeep, n)
+        self.vertices = self._storage[:n]
+
     def set_component_data(self, index, V):
         '''
         Replace a single component of the VBO with the new series of values,
@@ -114,13 +240,27 @@ class VBO:
         simply replace them all.
         '''
         if self.ncomponents == 2:
-            self.set_data(np.column_stack((X, Y)).astype(np.float32,
-                                                         copy=False))
+            self._resize(len(X))
+            self.vertices[:, 0] = X
+            self.vertices[:, 1] = Y
+            self._update_vbo()
         else:
             self.vertices[:, 0] = X
             self.vertices[:, 1] = Y
             self._update_vbo()
 
+    def sub_data(self, index, vertices):
+        '''
+        Substitutes whole vertices starting at the specified index.  The data
+        will be extended if the vertices to be substituted in go past the end
+        of the existing data.
+        '''
+        assert index <= len(self.vertices)
+        end = index + len(vertices)
+        self._resize(max(len(self.vertices), end))
+        self.vertices[index:end] = vertices
+        self._sub_vbo(index, len(vertices))
+
     def sub_x_y_data(self, index, X, Y):
         '''
         Substitutes X and Y components starting at the specified index.  The
@@ -129,13 +269,55 @@ class VBO:
         '''
         assert len(X) == len(Y)
         assert index <= len(self.vertices)
-        sub_data     = np.column_stack((X, Y)).astype(np.float32, copy=False)
-        overlap_data = sub_data[:len(self.vertices) - index]
-        new_data     = sub_data[len(self.vertices) - index:]
-        if len(overlap_data):
-            self.vertices[-len(overlap_data):] = overlap_data
-        self.vertices = np.concatenate((self.vertices, new_data))
-        self._sub_vbo_tail(len(X))
+        end = index + len(X)
+        self._resize(max(len(self.vertices), end))
+        self.vertices[index:end, 0] = X
+        self.vertices[index:end, 1] = Y
+        self._sub_vbo(index, len(X))
+
+
+class DeviceVBO(VBO):
+    '''
+    A VBO that keeps no host copy of its vertices, for buffers whose contents
+    can be regenerated from some other source.  Vertices are passed in
+    already encoded as float32 rows of ncomponents values.
+    '''
+    def __init__(self, ncomponents, gl_type=GL.GL_DYNAMIC_DRAW):
+        super().__init__(ncomponents=ncomponents, gl_type=gl_type)
+        self.nvertices = 0
+
+    def __len__(self):
+        return self.nvertices
+
+    def fits(self, n):
+        '''
+        Returns True if n vertices fit in the buffer without reallocating it,
+        which would lose its contents.
+        '''
+        return n <= self.capacity
+
+    def set_data(self, vertices, index=0):
+        '''
+        Uploads the vertices starting at index, discarding any vertices past
+        them.  If index is not 0, the buffer must already fit the result.
+        '''
+        end = index + len(vertices)
+        gldispatch.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        if not self.fits(end):
+            assert index == 0
+            self.capacity = ceil_pow2(max(end, 1))
+            GL.glBufferData(GL.GL_ARRAY_BUFFER,
+                            4 * self.ncomponents * self.capacity,
+                            None, self.gl_type)
+
+        for i in range(0, len(vertices), UPLOAD_CHUNK_LEN):
+            V = np.ascontiguousarray(vertices[i:i + UPLOAD_CHUNK_LEN],
+                                     dtype=np.float32)
+            gldispatch.glBufferSubData(GL.GL_ARRAY_BUFFER,
+                                       4 * self.ncomponents * (index + i),
+                                       V.nbytes, V)
+        self.nvertices  = end
+        self.version   += 1
 
 
 class StaticVBO(VBO):
@@ -3,6 +3,8 @@ from OpenGL import GL
 
 from . import vbo
 from . import programs
+from . import glstate
+from . import gldispatch
 
 
 INSTANCE_GEOMETRY = np.array(
@@ -24,7 +26,7 @@ class VLine:
         self.vertices = [(x, -1), (x, 1)]
 
         self.line_vao = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.line_vao)
+        glstate.bind_vertex_array(self.line_vao)
 
         self.vert_vbo = vbo.VBO(self.vertices)
         self.vert_vbo._attrib_pointer(0)
@@ -40,7 +42,7 @@ class VLine:
         GL.glEnableVertexAttribArray(2)
         GL.glVertexAttribDivisor(2, 0)
 
-        GL.glBindVertexArray(0)
+        glstate.bind_vertex_array(0)
 
     def renormalize(self):
         x = self.x * self.plot.rmatrix[0][0] + self.plot.rmatrix[0][3]
@@ -56,10 +58,11 @@ class VLine:
         self.vert_vbo.vertices[1][1] = t
         self.vert_vbo._update_vbo()
 
-        GL.glBindVertexArray(self.line_vao)
+        glstate.bind_vertex_array(self.line_vao)
         programs.square_line.use(self.width, z, mvp, color=self.color,
                                  resolution=resolution)
-        GL.glDrawArraysInstanced(GL.GL_TRIANGLES, 0, len(INSTANCE_GEOMETRY), 1)
+        gldispatch.glDrawArraysInstanced(GL.GL_TRIANGLES, 0,
+                                         len(INSTANCE_GEOMETRY), 1)
 
     def set_x_data(self, x):
         self.x = x